@@ -1,6 +1,6 @@
 #!/bin/sh
 # (copyleft) Efenstor 2015-2025
-# Revision 2025-04-30
+# Revision 2026-10-18
 
 file_proc_script="file_proc_vs.sh"
 
@@ -19,7 +19,8 @@ YELLOW="\033[1;33m"
 NC="\033[0m"
 
 # Parse the named parameters
-optstr="?he:d:a:pnl"
+jobs=1
+optstr="?he:d:a:pnlq:j:t:"
 while getopts $optstr opt; do
   case "$opt" in
     e) file_proc_params="$file_proc_params -e $OPTARG"
@@ -32,6 +33,12 @@ while getopts $optstr opt; do
        ;;
     l) file_proc_params="$file_proc_params -l"
        ;;
+    q) queue_dir=$OPTARG
+       ;;
+    j) jobs=$OPTARG
+       ;;
+    t) threads=$OPTARG
+       ;;
     :) echo "Missing argument for -$OPTARG" >&2
        exit 1
        ;;
@@ -47,6 +54,21 @@ if [ $# -lt 4 ]; then
 ${YELLOW}Batch convert files using VapourSynth
 ${GREEN}(copyleft) Efenstor${NC}\n
 Usage: batch_proc_vs [options] <src_dir> <src_ext> <dst_dir> <proc.py>
+Options:
+  -q queue_dir  work queue mode: any number of batch_proc_vs instances started
+                with the same parameters and queue_dir (on the same or other
+                hosts sharing the directories) process the files together,
+                each file is claimed by one of them; if an instance crashes
+                its file is taken over by another one after a timeout; the
+                finished files are remembered in queue_dir (for the same
+                script and options), delete queue_dir/done to process them
+                again
+  -j jobs       process this number of files at once; the output of every
+                file goes to <dst_dir>/<src_file>.log (kept if it fails),
+                a failed or cancelled file stops the whole batch
+  -t threads    total number of VapourSynth threads, split between the jobs
+                (default with -j: number of CPUs, otherwise see
+                $file_proc_script)
 Parameters:
   src_dir  source directory containing files to process and encode
   src_ext  extension of the source files (without dot, e.g. mp4)
@@ -54,7 +76,7 @@ Parameters:
            exist it will be created
   proc.py  VapourSynth script to be used for processing
 
-For description of the options see $file_proc_script.
+For description of the other options see $file_proc_script.
 \n"
   exit
 fi
@@ -67,18 +89,147 @@ script="$4"
 
 echo
 
-files=$(find "$src_dir" -maxdepth 1 -type f -iname "*.$src_ext" | sort -n -f)
-while [ -n "$files" ]
-do
-  i=$(echo "$files" | head -n 1)
-  files=$(echo "$files" | tail -n +2)
-  # Process
-  if [ $file_proc_params ]; then
-    "$SDIR"/"$file_proc_script" "$file_proc_params" "$i" "$dst_dir" "$script"
-  else
-    "$SDIR"/"$file_proc_script" "$i" "$dst_dir" "$script"
+# Process a single file
+process_file() {
+  "$SDIR"/"$file_proc_script" $file_proc_params "$1" "$dst_dir" "$script"
+}
+
+# Process a file, claiming it first in the work queue mode
+# $1 = file; returns 2 if the file is claimed by another worker
+job_item=
+run_job() {
+  if [ $queue_dir ]; then
+    if ! queue_claim "$queue_dir" "$(basename "$1")$queue_suffix"; then
+      return 2
+    fi
+    job_item="$(basename "$1")$queue_suffix"
   fi
+  process_file "$1"
   # Cancelled
-  if [ $file_proc_vs_exit ]; then exit $?; fi
+  if [ $? -ne 0 ] || [ $file_proc_vs_exit ]; then
+    if [ $job_item ]; then queue_release "$queue_dir" "$job_item"; fi
+    return 1
+  fi
+  if [ $job_item ]; then queue_done "$queue_dir" "$job_item"; fi
+  job_item=
+  return 0
+}
+
+# Run a job, in the background as soon as a slot is free with -j
+# $1 = file; returns 1 if the batch is cancelled
+start_job() {
+  if [ $jobs -le 1 ]; then
+    run_job "$1"
+    [ $? -ne 1 ]
+    return
+  fi
+  # Every free slot is a line in the pool FIFO
+  read -r token <&3
+  if [ -e "$pool_dir/cancel" ]; then return 1; fi
+  (
+    trap 'if [ $job_item ]; then queue_release "$queue_dir" "$job_item"; fi; exit 1' INT TERM
+    # The claims of the job are its own ($$ is the PID of the batch)
+    queue_pid=$(exec sh -c 'echo $PPID')
+    log="$dst_dir/$(basename "$1").log"
+    run_job "$1" > "$log" 2>&1 < /dev/null
+    case $? in
+      0) echo "Done: $1"
+         rm "$log"
+         ;;
+      2) rm "$log"
+         ;;
+      *) printf "${RED}Failed: %s (see \"%s\")${NC}\n" "$1" "$log"
+         touch "$pool_dir/cancel"
+         ;;
+    esac
+    echo >&3
+  ) &
+  pids="$pids $!"
+}
+
+# Kill a process with all its descendants
+# $1 = pid
+kill_tree() {
+  kids=$(pgrep -P $1)
+  kill $1
+  for k in $kids; do kill_tree $k; done
+}
+
+# Stop all the running jobs
+cancel() {
+  trap - INT TERM
+  printf "${RED}Cancelling the batch...${NC}\n"
+  for p in $pids; do kill_tree $p; done 2>/dev/null
+  wait
+  exit 1
+}
+
+files=$(find "$src_dir" -maxdepth 1 -type f -iname "*.$src_ext" | sort -n -f)
+
+if [ $jobs -gt 1 ]; then
+  # Split the thread budget between the jobs
+  num_files=$(echo "$files" | grep -c .)
+  if [ ! $queue_dir ] && [ $jobs -gt $num_files ] && [ $num_files -gt 0 ]; then
+    jobs=$num_files
+  fi
+  if [ ! $threads ]; then threads=$(nproc); fi
+  threads=$(( threads / jobs ))
+  if [ $threads -lt 1 ]; then threads=1; fi
+  echo "Processing $jobs files at once, $threads threads each"
+  # Job slot pool
+  mkdir -p "$dst_dir"
+  pool_dir=$(mktemp -d)
+  trap 'rm -rf "$pool_dir"' EXIT
+  trap cancel INT TERM
+  mkfifo "$pool_dir/slots"
+  exec 3<>"$pool_dir/slots"
+  i=0
+  while [ $i -lt $jobs ]; do
+    echo >&3
+    i=$(( i + 1 ))
+  done
+fi
+if [ $queue_dir ]; then
+  . "$SDIR/queue.sh"
+  queue_init "$queue_dir"
+  # The files done with another script or other options are not skipped (the
+  # number of threads may differ between the hosts)
+  queue_suffix="#$( (cat "$script" "$SDIR/$file_proc_script"; \
+    echo "$src_ext $file_proc_params $FPVS_TIER $FPVS_MVPROXY") | queue_key)"
+fi
+
+if [ $threads ]; then
+  file_proc_params="$file_proc_params -t $threads"
+fi
+
+# In the work queue mode repeat until every file is done by us or by other
+# workers
+while true; do
+  remaining=
+  queue=$files
+  while [ -n "$queue" ]
+  do
+    i=$(echo "$queue" | head -n 1)
+    queue=$(echo "$queue" | tail -n +2)
+    if [ $queue_dir ]; then
+      if queue_isdone "$queue_dir" "$(basename "$i")$queue_suffix"; then
+        continue
+      fi
+      remaining=true
+    fi
+    # Process
+    if ! start_job "$i"; then
+      if [ $jobs -gt 1 ]; then cancel; fi
+      exit 1
+    fi
+  done
+  if [ ! $remaining ]; then break; fi
+  # Files still being processed by others, wait for them to finish or crash
+  sleep $queue_heartbeat
 done
 
+# Wait for the last jobs
+for p in $pids; do
+  wait $p
+  if [ -e "$pool_dir/cancel" ]; then cancel; fi
+done
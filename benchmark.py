@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# BENCHMARK.PY
+# Throughput benchmark of the functions.py filters
+#
+# Runs every filter on a synthetic clip (a panning random texture with
+# temporal noise on top, so that the motion search has something to find) at
+# SD, HD and UHD sizes and with several thread counts, and measures the graph
+# build time, the rendering speed and the peak memory. Every case runs in a
+# separate process, so the memoized motion analysis and the frame caches of
+# one case do not affect the others and the peak memory is per case. Filters
+# whose plugins are not installed are skipped.
+#
+# The results can be saved as a baseline (JSON) and later runs compared to it,
+# e.g. after a parameter change or a plugin upgrade:
+#   benchmark.py -o baseline.json
+#   benchmark.py -c baseline.json
+# See benchmark.py -h for the options.
+#
+# Requirements: VapourSynth (and the plugins of the filters to measure)
+
+import vapoursynth as vs
+from vapoursynth import core
+import argparse
+import ctypes
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sizes = {
+	"SD": (720, 480),
+	"HD": (1920, 1080),
+	"UHD": (3840, 2160),
+}
+
+# name: (plugin namespaces, filter)
+def _cases():
+
+	import functions as f
+
+	return {
+		"denoise": (["mv"], lambda c: f.denoise(c)),
+		"denoise2": (["mv"], lambda c: f.denoise2(c)),
+		"denoise3": (["mv", "tbilateral", "neo_fft3d", "pp7"],
+				lambda c: f.denoise3(c)),
+		"dehalo": (["tbilateral", "grain"], lambda c: f.dehalo(c)),
+		"asharpen": (["asharp"], lambda c: f.asharpen(c)),
+		"deblock": (["pp7", "mv"], lambda c: f.deblock(c)),
+		"decanon": (["mv", "deblock", "vinverse"], lambda c: f.decanon(c)),
+		"fixfieldjitter": (["mv", "znedi3"], lambda c: f.fixfieldjitter(c)),
+		"restoredetails": (["mv"], lambda c: f.restoredetails(c)),
+		"flowfps": (["mv"], lambda c: f.flowfps(c)),
+		"deghost": (["lghost"], lambda c: f.deghost(c)),
+		"deaberration": ([], lambda c: f.deaberration(c)),
+		"unsharpmask": ([], lambda c: f.unsharpmask(c)),
+		"sharpen": ([], lambda c: f.sharpen(c)),
+		"lumachroma": ([], lambda c: f.lumachroma(c, gamma=1.1, chroma=8)),
+	}
+
+# Random texture as a single frame clip
+def _texture(width, height, seed):
+
+	data = random.Random(seed).randbytes(width*height*3//2)
+	clip = core.std.BlankClip(width=width, height=height, format=vs.YUV420P8,
+			length=1)
+
+	def fill(n, f):
+		fout = f.copy()
+		offset = 0
+		for p in range(fout.format.num_planes):
+			stride = fout.get_stride(p)
+			w = fout.width>>(fout.format.subsampling_w if p else 0)
+			h = fout.height>>(fout.format.subsampling_h if p else 0)
+			ptr = fout.get_write_ptr(p).value
+			for y in range(h):
+				ctypes.memmove(ptr+y*stride, data[offset:offset+w], w)
+				offset += w
+		return fout
+
+	return core.std.ModifyFrame(clip, clip, fill)
+
+# Synthetic test clip: a panning texture (2 px/frame right, 1 px/frame down)
+# plus temporal noise, looped every 16 frames
+def testclip(width, height, length, seed=0):
+
+	period = 16
+	margin = period*2
+	pan = _texture(width+margin, height+margin, seed)
+	noise = _texture(width+margin, height+margin, seed+1)
+	frames = []
+	for i in range(period):
+		a = core.std.CropAbs(pan, width, height, left=i*2, top=i)
+		b = core.std.CropAbs(noise, width, height, left=(i*7)%margin,
+				top=(i*5)%margin)
+		frames.append(core.std.Expr([a, b], "x 0.8 * y 0.2 * + 6 +"))
+	clip = core.std.Splice(frames)*((length+period-1)//period)
+	clip = core.std.AssumeFPS(clip[:length], fpsnum=24000, fpsden=1001)
+
+	return core.std.SetFrameProps(clip, _FieldBased=0)
+
+# Run a single case in this process, return the result as a dict
+def runcase(name, size, threads, frames):
+
+	plugins, func = _cases()[name]
+	missing = [ns for ns in plugins if not hasattr(core, ns)]
+	if missing:
+		return {"skip": "missing plugin(s): %s" % ", ".join(missing)}
+	if threads>0:
+		core.num_threads = threads
+
+	width, height = sizes[size]
+	warmup = 8
+	src = testclip(width, height, frames+warmup*4)
+
+	start = time.perf_counter()
+	try:
+		clip = func(src)
+	except AttributeError as e:
+		# a plugin function not covered by the namespace check
+		return {"skip": str(e)}
+	build = time.perf_counter()-start
+
+	# skip the frames at the start, where the temporal filters have fewer
+	# neighbours
+	clip = clip[warmup:]
+	for n in range(warmup):
+		clip.get_frame(n)
+	start = time.perf_counter()
+	count = 0
+	for f in clip[warmup:warmup+frames].frames():
+		count += 1
+	elapsed = time.perf_counter()-start
+
+	return {
+		"build": build,
+		"fps": count/elapsed,
+		"memory": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024,
+		"threads": core.num_threads,
+	}
+
+# Run a case in a separate process
+def spawncase(name, size, threads, frames):
+
+	proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+			"--case", name, size, str(threads), str(frames)],
+			stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+	if proc.returncode!=0:
+		err = proc.stderr.strip().splitlines()
+		return {"error": err[-1] if err else "exit code %d" % proc.returncode}
+
+	return json.loads(proc.stdout.strip().splitlines()[-1])
+
+# Compare results to a baseline, return the list of regressions
+# tolerance: allowed relative change
+def compare(results, baseline, tolerance):
+
+	regressions = []
+	for key, res in results.items():
+		base = baseline.get(key)
+		if base==None or "fps" not in base or "fps" not in res:
+			continue
+		if res["fps"]<base["fps"]*(1-tolerance):
+			regressions.append("%s: %.2f fps, was %.2f" % (key, res["fps"],
+					base["fps"]))
+		if res["memory"]>base["memory"]*(1+tolerance):
+			regressions.append("%s: %d MiB, was %d" % (key, res["memory"]>>20,
+					base["memory"]>>20))
+		# ignore the noise of very fast graph builds
+		if res["build"]>base["build"]*(1+tolerance) and \
+				res["build"]-base["build"]>0.05:
+			regressions.append("%s: graph built in %.3f s, was %.3f" % (key,
+					res["build"], base["build"]))
+
+	return regressions
+
+def main():
+
+	parser = argparse.ArgumentParser(
+			description="Benchmark the functions.py filters")
+	parser.add_argument("-f", "--filters", help="comma-separated list of "
+			"filters (default: all)")
+	parser.add_argument("-s", "--sizes", default="SD,HD,UHD",
+			help="comma-separated list of sizes (default: %(default)s)")
+	parser.add_argument("-t", "--threads", default="1,4,0",
+			help="comma-separated list of thread counts, 0 = all (default: "
+			"%(default)s)")
+	parser.add_argument("-n", "--frames", type=int, default=50,
+			help="number of frames to render (default: %(default)s)")
+	parser.add_argument("-o", "--output", help="save the results (e.g. as a new "
+			"baseline) to this JSON file")
+	parser.add_argument("-c", "--compare", help="compare to this baseline JSON "
+			"file, exit with code 1 if anything got slower")
+	parser.add_argument("-r", "--tolerance", type=float, default=0.1,
+			help="allowed relative change to the baseline (default: "
+			"%(default)s)")
+	parser.add_argument("--case", nargs=4, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	# Child process
+	if args.case:
+		name, size, threads, frames = args.case
+		print(json.dumps(runcase(name, size, int(threads), int(frames))))
+		return
+
+	names = list(_cases().keys())
+	if args.filters:
+		names = [n for n in args.filters.split(",") if n in names]
+	baseline = {}
+	if args.compare:
+		with open(args.compare) as bf:
+			baseline = json.load(bf)["results"]
+
+	results = {}
+	for name in names:
+		for size in args.sizes.split(","):
+			for threads in (int(t) for t in args.threads.split(",")):
+				key = "%s/%s/%d" % (name, size, threads)
+				res = spawncase(name, size, threads, args.frames)
+				results[key] = res
+				if "skip" in res:
+					print("%-32s skipped (%s)" % (key, res["skip"]))
+					break
+				if "error" in res:
+					print("%-32s error: %s" % (key, res["error"]))
+					continue
+				line = "%-32s %8.2f fps %8.3f s build %6d MiB" % (key, res["fps"],
+						res["build"], res["memory"]>>20)
+				base = baseline.get(key)
+				if base and "fps" in base:
+					line += " (%+.1f%%)" % ((res["fps"]/base["fps"]-1)*100)
+				print(line, flush=True)
+			else:
+				continue
+			break
+
+	if args.output:
+		with open(args.output, "w") as of:
+			json.dump({"vapoursynth": str(core.version_number()),
+					"frames": args.frames, "results": results}, of, indent=1)
+
+	if args.compare:
+		regressions = compare(results, baseline, args.tolerance)
+		if regressions:
+			print("\nRegressions:")
+			for r in regressions:
+				print("  "+r)
+			sys.exit(1)
+		print("\nNo regressions")
+
+if __name__=="__main__":
+	main()
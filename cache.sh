@@ -0,0 +1,157 @@
+# Per-source cache, sourced by file_proc_vs.sh (see also sourcecache.py)
+# (copyleft) Efenstor 2015-2026
+#
+# Things about a source file that take long to find out are stored once in
+# <cache_dir>/<kind>/<source_key>.*, where the key (the same as used by
+# vectorstore.py) changes when the file is replaced or modified. The cache dir
+# can be set with the FPVS_CACHE_DIR environment variable. The Python scripts
+# read and write the same files through sourcecache.py.
+
+cache_dir="${FPVS_CACHE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/file_proc_vs}"
+
+# Identity of a source file: sha1 of the real path, size and mtime in ns
+# $1 = file
+source_key() {
+  printf '%s\0%s\0%s' "$(realpath "$1")" "$(stat -c %s "$1")" \
+    "$(stat -c %.9Y "$1" | tr -d .)" | sha1sum | cut -d " " -f 1
+}
+
+# Property of a stream as reported by ffprobe, all the properties of the stream
+# are probed once
+# $1 = file, $2 = stream specifier (v:0, a:0...) or "format" for the properties
+# of the container, $3 = property (e.g. start_time)
+cache_probe() {
+  c_probe="$cache_dir/probe/$(source_key "$1").$(echo "$2" | tr -d :)"
+  if [ ! -e "$c_probe" ]; then
+    mkdir -p "$cache_dir/probe"
+    if [ "$2" = "format" ]; then
+      c_show="-show_format"
+    else
+      c_show="-show_streams -select_streams $2"
+    fi
+    ffprobe -v error $c_show -of default=nw=1 "$1" \
+      > "$c_probe.$$" && mv "$c_probe.$$" "$c_probe"
+    rm -f "$c_probe.$$"
+  fi
+  sed -n "s/^$3=//p" "$c_probe" 2>/dev/null | head -n 1
+}
+
+# Build the frame index: the timestamps of all the video frames in display
+# order, read from the packets (demuxing only, no decoding). The timestamps of
+# the keyframes go to a second file with the extension .key
+# $1 = file; prints the name of the index file, returns 1 if the file has no
+# timestamps
+cache_index() {
+  c_index="$cache_dir/index/$(source_key "$1").pts"
+  if [ ! -e "$c_index" ] || [ ! -e "${c_index%.pts}.key" ]; then
+    mkdir -p "$cache_dir/index"
+    echo "Building the frame index..." >&2
+    ffprobe -v error -select_streams v:0 \
+      -show_entries packet=pts_time,dts_time,flags -of csv=p=0 "$1" | \
+      awk -F, -v keys="$c_index.key.$$" \
+        '{ t = ($1 != "N/A" && $1 != "") ? $1 : $2
+           if (t == "N/A" || t == "") next
+           print t
+           if (index($3, "K")) print t > keys }' | \
+      sort -g > "$c_index.$$"
+    if [ ! -s "$c_index.$$" ]; then
+      rm -f "$c_index.$$" "$c_index.key.$$"
+      return 1
+    fi
+    touch "$c_index.key.$$"
+    sort -g "$c_index.key.$$" > "${c_index%.pts}.key"
+    rm -f "$c_index.key.$$"
+    mv "$c_index.$$" "$c_index"
+  fi
+  echo "$c_index"
+}
+
+# Build the index of the frames output by the source filter: with soft
+# telecine (MPEG-2 with repeat-field flags) functions.source (LWLibavSource
+# with repeat=1) outputs more frames than there are packets, then the
+# timestamps of the decoded frames are read (decoding the whole file) and the
+# frames made of the repeated fields are added; otherwise it is the same as
+# the frame index. The flags are looked for in the first 500 frames and the
+# 500 frames from the middle of the file.
+# $1 = file; prints the name of the index file, returns 1 if the file has no
+# timestamps
+cache_frames() {
+  c_index=$(cache_index "$1") || return 1
+  c_frames="${c_index%.pts}.frames"
+  if [ ! -e "$c_frames" ]; then
+    c_mid=$(awk '{ t[NR] = $1 } END { print t[int(NR / 2) + 1] - t[1] }' \
+      "$c_index")
+    if ffprobe -v error -select_streams v:0 \
+      -read_intervals "%+#500,$c_mid%+#500" -show_entries frame=repeat_pict \
+      -of csv=p=0 "$1" | grep -q "[1-9]"; then
+      echo "Soft telecine found, indexing the decoded frames..." >&2
+      ffprobe -v error -select_streams v:0 \
+        -show_entries frame=best_effort_timestamp_time,pkt_dts_time,repeat_pict \
+        -of compact=p=0 "$1" | \
+        awk -F "|" '{ t = ""; r = 0
+            for (i = 1; i <= NF; i++) {
+              split($i, kv, "=")
+              if (kv[1] == "best_effort_timestamp_time" && kv[2] != "N/A") t = kv[2]
+              else if (kv[1] == "pkt_dts_time" && t == "" && kv[2] != "N/A") t = kv[2]
+              else if (kv[1] == "repeat_pict") r = kv[2]
+            }
+            if (t != "") print t, r }' | sort -g | \
+        awk '# Every frame has 2 + repeat_pict fields, 2 fields make a frame
+          function emit(t, r, next_t) {
+            fields += 2 + r
+            k = int(fields / 2) - out
+            for (i = 0; i < k; i++) printf "%.6f\n", t + (next_t - t) * i / k
+            out += k
+          }
+          NR > 1 { emit(pt, pr, $1); d = $1 - pt }
+          { pt = $1; pr = $2 }
+          END { if (NR) emit(pt, pr, pt + d) }' > "$c_frames.$$"
+      if [ ! -s "$c_frames.$$" ]; then
+        rm -f "$c_frames.$$"
+        return 1
+      fi
+      mv "$c_frames.$$" "$c_frames"
+    else
+      cp "$c_index" "$c_frames.$$" && mv "$c_frames.$$" "$c_frames"
+    fi
+  fi
+  echo "$c_frames"
+}
+
+# Number of the first frame at or after a time (relative to the first frame)
+# $1 = file, $2 = time in seconds
+cache_time_to_frame() {
+  c_index=$(cache_frames "$1") || return 1
+  awk -v t="$2" 'NR == 1 { b = $1 } $1 < b + t - 0.0001 { n++ }
+    END { print n + 0 }' "$c_index"
+}
+
+# Scene cuts: numbers of the first frames of the scenes (without frame 0),
+# found by the scene score of ffmpeg on a downscaled copy and converted to
+# the numbers of the frames output by the source filter (see cache_frames;
+# the same file as written by sourcecache.scenecuts)
+# $1 = file, $2 = scene score threshold (0..1); prints the name of the file,
+# returns 1 if the file has no timestamps or the detection failed
+cache_scenecuts() {
+  c_index=$(cache_frames "$1") || return 1
+  c_cuts="$cache_dir/scenecuts/$(source_key "$1").$2"
+  if [ ! -e "$c_cuts" ]; then
+    mkdir -p "$cache_dir/scenecuts"
+    echo "Detecting the scene cuts..." >&2
+    ffmpeg -nostdin -hide_banner -loglevel error -copyts -i "$1" -map 0:v:0 \
+      -vf "scale=256:-2,select='gt(scene,$2)',metadata=print:file=-" \
+      -f null - > "$c_cuts.$$"
+    if [ $? -ne 0 ]; then
+      rm -f "$c_cuts.$$"
+      return 1
+    fi
+    sed -n "s/.*pts_time:\([^ ]*\).*/\1/p" "$c_cuts.$$" | \
+      awk 'FNR == NR { pts[n++] = $1; next }
+        { while (i < n && pts[i] < $1 - 0.0001) i++
+          if (i > 0 && i < n && i > last) print last = i }' "$c_index" - \
+      > "$c_cuts.$$.n"
+    mv "$c_cuts.$$.n" "$c_cuts"
+    rm -f "$c_cuts.$$"
+  fi
+  echo "$c_cuts"
+}
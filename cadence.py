@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# CADENCE.PY
+# Detection of duplicate frame cadences for functions.mdedup
+#
+# Streams the clip once, measures the difference of every frame to the
+# previous one (done by VapourSynth on a downscaled luma plane, so it is
+# multi-threaded and much faster than real time), classifies the frames as
+# duplicates, finds the repeating pattern in blocks of frames and where it
+# breaks, and writes a pattern file for mdedup(clip, patternfile=...).
+#
+# Usage: cadence.py [options] <src_file> <pattern_file>
+# See cadence.py -h for the options.
+#
+# Requirements: VapourSynth, L-SMASH Source (unless a script is used)
+
+import vapoursynth as vs
+from vapoursynth import core
+import functions
+from driver import evalscript
+import argparse
+import sys
+import time
+
+# Difference of every frame to the previous one (0..1, 0 for the first frame)
+def framediffs(clip, width=320, prefetch=None, progress=False):
+
+	luma = core.std.ShufflePlanes(clip, 0, vs.GRAY)
+	height = max(2, int(luma.height*width/luma.width)>>1<<1)
+	small = core.resize.Bilinear(luma, width=width, height=height,
+			format=vs.GRAY8 if luma.format.bits_per_sample<=8 else vs.GRAY16)
+	prev = small[0]+small[:-1]
+	stats = core.std.PlaneStats(small, prev)
+
+	diffs = []
+	start = time.monotonic()
+	for n, f in enumerate(stats.frames(prefetch=prefetch)):
+		diffs.append(f.props["PlaneStatsDiff"])
+		if progress and n%1000==999:
+			fps = (n+1)/(time.monotonic()-start)
+			print("\r%d/%d frames, %.1f fps" % (n+1, clip.num_frames, fps),
+					end="", file=sys.stderr)
+	if progress:
+		print(file=sys.stderr)
+
+	return diffs
+
+# Classify frames as duplicates of the previous frame, relative to the amount
+# of motion around them; None means undecidable (static picture)
+def duplicates(diffs, block=240, ratio=0.25, static=0.002):
+
+	dups = []
+	for b in range(0, len(diffs), block):
+		chunk = diffs[b:b+block]
+		motion = sorted(chunk)[len(chunk)*3//4]
+		if motion<static:
+			dups.extend([None]*len(chunk))
+		else:
+			dups.extend(d<motion*ratio for d in chunk)
+
+	return dups
+
+# Best periodic pattern for a block of frames, as a tuple of booleans indexed by
+# absolute frame number modulo period (True = duplicate), or None
+def blockpattern(dups, start, end, max_period=12, accuracy=0.95):
+
+	known = [n for n in range(start, end) if dups[n]!=None]
+	if len(known)<(end-start)//2:
+		return None
+
+	for period in range(2, max_period+1):
+		if len(known)<period*3:
+			break
+		count = [0]*period
+		total = [0]*period
+		for n in known:
+			total[n%period] += 1
+			count[n%period] += dups[n]
+		pattern = tuple(total[i]>0 and count[i]*2>total[i] for i in range(period))
+		if not any(pattern) or all(pattern):
+			continue
+		errors = sum(min(count[i], total[i]-count[i]) for i in range(period))
+		if errors<=len(known)*(1-accuracy):
+			return pattern
+
+	# no duplicates found at all: keep everything
+	if sum(dups[n] for n in known)<=len(known)*(1-accuracy):
+		return (False,)
+
+	return None
+
+# Number of frames in range matching a pattern (None frames always match)
+def _matches(dups, pattern, start, end):
+
+	period = len(pattern)
+	return sum(1 for n in range(start, end)
+			if dups[n]==None or dups[n]==pattern[n%period])
+
+# Find the repeating patterns and where they change, return the segments as
+# [(start_frame, pattern), ...]
+def segments(dups, block=120, max_period=12, accuracy=0.95):
+
+	# patterns of the blocks, undecidable blocks take the previous pattern
+	blocks = []
+	for b in range(0, len(dups), block):
+		pattern = blockpattern(dups, b, min(b+block, len(dups)), max_period,
+				accuracy)
+		if pattern==None and blocks:
+			pattern = blocks[-1][1]
+		blocks.append((b, pattern))
+	# leading undecidable blocks take the first known pattern
+	first = next((p for b, p in blocks if p!=None), (False,))
+	blocks = [(b, p if p!=None else first) for b, p in blocks]
+
+	# merge the blocks, refine the breaks to the exact frame
+	segs = []
+	for b, pattern in blocks:
+		if segs and segs[-1][1]==pattern:
+			continue
+		if not segs:
+			segs.append((0, pattern))
+			continue
+		# the break is somewhere between the previous block and the end of this
+		# one: pick the split that fits both patterns best
+		prev = segs[-1][1]
+		lo = max(segs[-1][0], b-block)
+		hi = min(b+block, len(dups))
+		best, best_score = b, -1
+		for split in range(lo, hi+1):
+			score = _matches(dups, prev, lo, split)+_matches(dups, pattern, split, hi)
+			if score>best_score:
+				best, best_score = split, score
+		if best<=segs[-1][0]:
+			segs[-1] = (segs[-1][0], pattern)
+		else:
+			segs.append((best, pattern))
+
+	return segs
+
+def writepattern(path, segs, comment=None):
+
+	with open(path, "w") as pf:
+		pf.write("# mdedup pattern file: start_frame pattern offset\n")
+		if comment:
+			pf.write("# %s\n" % comment)
+		for start, pattern in segs:
+			# the offset makes the pattern phase equal to frame%period
+			pf.write("%d %s %d\n" % (start,
+					"".join("-" if d else "+" for d in pattern),
+					start%len(pattern)))
+
+def main():
+
+	parser = argparse.ArgumentParser(
+			description="Detect duplicate frame cadences and write a pattern file "
+			"for mdedup")
+	parser.add_argument("src_file", help="source video file")
+	parser.add_argument("pattern_file", help="pattern file to write")
+	parser.add_argument("-s", "--script", help="VapourSynth script producing "
+			"the clip to be deduplicated (gets the source as 'filename', like "
+			"with file_proc_vs.sh), by default the source is opened with "
+			"LWLibavSource (with the index in the shared cache)")
+	parser.add_argument("-b", "--block", type=int, default=120,
+			help="analysis block size in frames (default: %(default)s)")
+	parser.add_argument("-m", "--max-period", type=int, default=12,
+			help="longest pattern to look for (default: %(default)s)")
+	parser.add_argument("-r", "--ratio", type=float, default=0.25,
+			help="a frame is a duplicate if its difference is below this part of "
+			"the typical difference around it (default: %(default)s)")
+	parser.add_argument("-a", "--accuracy", type=float, default=0.95,
+			help="part of the frames that has to fit the pattern "
+			"(default: %(default)s)")
+	parser.add_argument("-t", "--threads", type=int, default=0,
+			help="VapourSynth threads (default: all)")
+	args = parser.parse_args()
+
+	if args.threads>0:
+		core.num_threads = args.threads
+	if args.script:
+		clip = evalscript(args.script, args.src_file)
+	else:
+		clip = functions.source(args.src_file, repeat=1)
+
+	diffs = framediffs(clip, progress=True)
+	dups = duplicates(diffs, ratio=args.ratio)
+	segs = segments(dups, args.block, args.max_period, args.accuracy)
+	writepattern(args.pattern_file, segs, "%s, %d frames" % (args.src_file,
+			clip.num_frames))
+
+	for start, pattern in segs:
+		print("%8d: %s" % (start, "".join("-" if d else "+" for d in pattern)))
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# DRIVER.PY
+# In-process alternative to the vspipe | ffmpeg pipeline of file_proc_vs.sh
+#
+# Evaluates the processing script in this process, requests the frames itself
+# (the number of frames in flight is set directly instead of being left to
+# vspipe) and writes them as y4m to an ffmpeg process it manages, measuring
+# how long every frame took to render and to be taken by the encoder.
+#
+# From Python:
+#   import driver
+#   driver.process_file("src.mkv", "dst.mkv", "proc.py", start=1000, end=2000)
+# or with a clip:
+#   driver.encode(clip, "dst.mkv")
+# From the shell: driver.py [options] <src_file> <dst_file> <proc.py>
+# See driver.py -h for the options.
+#
+# Requirements: VapourSynth, ffmpeg
+
+import vapoursynth as vs
+from vapoursynth import core
+import argparse
+import collections
+import runpy
+import shlex
+import subprocess
+import sys
+import time
+
+ffmpeg_options_v = "-c:v libx264 -crf 20"
+ffmpeg_options_a = "-c:a aac -b:a 256k"
+
+# Evaluate a VapourSynth script the way vspipe does and return its output clip
+def evalscript(script, filename):
+
+	vs.clear_outputs()
+	runpy.run_path(script, init_globals={"filename": filename},
+			run_name="__vapoursynth__")
+	out = vs.get_output(0)
+
+	return getattr(out, "clip", out)
+
+# YUV4MPEG2 stream header of a clip (same as written by vspipe -c y4m)
+def y4mheader(clip, sar=(0, 0)):
+
+	fmt = clip.format
+	if fmt.sample_type!=vs.INTEGER:
+		raise vs.Error("driver: y4m output needs an integer format")
+	if fmt.color_family==vs.GRAY:
+		cs = "mono"
+	elif fmt.color_family==vs.YUV:
+		cs = {(1, 1): "420", (1, 0): "422", (0, 0): "444", (2, 0): "411",
+				(0, 1): "440"}.get((fmt.subsampling_w, fmt.subsampling_h))
+		if cs==None:
+			raise vs.Error("driver: unsupported subsampling for y4m")
+	else:
+		raise vs.Error("driver: y4m output needs a YUV or GRAY clip")
+	if fmt.bits_per_sample>8:
+		cs += ("p%d" if fmt.color_family==vs.YUV else "%d") % fmt.bits_per_sample
+
+	return "YUV4MPEG2 C%s W%d H%d F%d:%d Ip A%d:%d\n" % (cs,
+			clip.width, clip.height, clip.fps.numerator, clip.fps.denominator,
+			sar[0], sar[1])
+
+# Render a range of frames and feed them to ffmpeg
+# prefetch: number of frames requested ahead (default: number of threads)
+# timing: file name, write the timing of every frame there (CSV)
+# progress: print the progress to stderr
+# returns the summary of the timing as a dict
+def encode(clip, dst, start=0, end=None, prefetch=None, audio=None,
+		audio_start=0, options_v=ffmpeg_options_v, options_a=ffmpeg_options_a,
+		timing=None, progress=True):
+
+	if end==None or end>=clip.num_frames: end = clip.num_frames-1
+	if prefetch==None: prefetch = core.num_threads
+	clip = clip[start:end+1]
+
+	f0 = clip.get_frame(0)
+	sar = (f0.props.get("_SARNum", 0), f0.props.get("_SARDen", 0))
+	header = y4mheader(clip, sar).encode()
+
+	cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f",
+			"yuv4mpegpipe", "-i", "pipe:"]
+	if audio:
+		cmd += ["-ss", str(audio_start), "-i", audio, "-map", "0:v:0", "-map",
+				"1:a:0"]
+		cmd += shlex.split(options_v)+shlex.split(options_a)
+	else:
+		cmd += shlex.split(options_v)+["-an"]
+	cmd.append(dst)
+	encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+	# (frame, requested, ready, waited for, written in) for every frame
+	records = []
+	ready = {}
+	window = collections.deque()
+	requested = 0
+	started = time.monotonic()
+
+	def request(n):
+		fut = clip.get_frame_async(n)
+		fut.add_done_callback(lambda fut: ready.__setitem__(n, time.monotonic()))
+		window.append((n, time.monotonic(), fut))
+
+	try:
+		encoder.stdin.write(header)
+		for n in range(clip.num_frames):
+			while requested<clip.num_frames and requested<n+prefetch:
+				request(requested)
+				requested += 1
+			n, t_req, fut = window.popleft()
+			t0 = time.monotonic()
+			f = fut.result()
+			t1 = time.monotonic()
+			encoder.stdin.write(b"FRAME\n")
+			for p in range(f.format.num_planes):
+				encoder.stdin.write(memoryview(f[p]).tobytes())
+			t2 = time.monotonic()
+			records.append((start+n, t_req, ready.pop(n, t1), t1-t0, t2-t1))
+			del f
+			if progress and (n%100==99 or n==clip.num_frames-1):
+				print("\rFrame: %d/%d (%.2f fps)" % (n+1, clip.num_frames,
+						(n+1)/(t2-started)), end="", file=sys.stderr)
+	except BrokenPipeError:
+		pass
+	finally:
+		if progress: print(file=sys.stderr)
+		# drop the frames still being rendered
+		for n, t_req, fut in window:
+			fut.cancel()
+		try:
+			encoder.stdin.close()
+		except BrokenPipeError:
+			pass
+		if encoder.wait()!=0:
+			raise vs.Error("driver: ffmpeg failed (exit code %d)" %
+					encoder.returncode)
+
+	if timing:
+		with open(timing, "w") as tf:
+			tf.write("frame,render,wait,write\n")
+			for n, t_req, t_ready, wait, write in records:
+				tf.write("%d,%.6f,%.6f,%.6f\n" % (n, t_ready-t_req, wait, write))
+
+	return summary(records, time.monotonic()-started)
+
+# Summary of the timing records of encode
+def summary(records, elapsed):
+
+	render = sorted(r[2]-r[1] for r in records)
+	count = len(records)
+
+	return {
+		"frames": count,
+		"elapsed": elapsed,
+		"fps": count/elapsed if elapsed>0 else 0,
+		"render_avg": sum(render)/count if count else 0,
+		"render_median": render[count//2] if count else 0,
+		"render_max": render[-1] if count else 0,
+		# time spent waiting for the frames (filters are the bottleneck) and
+		# writing them (the encoder is the bottleneck)
+		"wait": sum(r[3] for r in records),
+		"write": sum(r[4] for r in records),
+		"slowest": [r[0] for r in sorted(records, key=lambda r: r[2]-r[1],
+				reverse=True)[:10]],
+	}
+
+# Process a file with a script, like file_proc_vs.sh without the preview
+# threads: VapourSynth threads (default: all)
+# the other arguments are the same as in encode
+def process_file(src, dst, script, start=0, end=None, threads=None, **args):
+
+	if threads: core.num_threads = threads
+	clip = evalscript(script, src)
+
+	return encode(clip, dst, start, end, **args)
+
+def main():
+
+	parser = argparse.ArgumentParser(
+			description="Process a file using VapourSynth in-process and encode "
+			"it with ffmpeg")
+	parser.add_argument("src_file", help="source file to process")
+	parser.add_argument("dst_file", help="output file")
+	parser.add_argument("script", help="VapourSynth script (gets the source as "
+			"'filename', like with file_proc_vs.sh)")
+	parser.add_argument("-s", "--start", type=int, default=0,
+			help="start frame (default: %(default)s)")
+	parser.add_argument("-e", "--end", type=int, help="end frame")
+	parser.add_argument("-t", "--threads", type=int, help="VapourSynth threads "
+			"(default: all)")
+	parser.add_argument("-r", "--prefetch", type=int, help="frames requested "
+			"ahead (default: number of threads)")
+	parser.add_argument("-a", "--audio", help="audio file to mux")
+	parser.add_argument("-d", "--audio-start", type=float, default=0,
+			help="audio start time in seconds (default: %(default)s)")
+	parser.add_argument("-v", "--options-v", default=ffmpeg_options_v,
+			help="ffmpeg video options (default: %(default)s)")
+	parser.add_argument("-o", "--options-a", default=ffmpeg_options_a,
+			help="ffmpeg audio options (default: %(default)s)")
+	parser.add_argument("-m", "--timing", help="write the timing of every frame "
+			"to this CSV file")
+	args = parser.parse_args()
+
+	stats = process_file(args.src_file, args.dst_file, args.script, args.start,
+			args.end, args.threads, prefetch=args.prefetch, audio=args.audio,
+			audio_start=args.audio_start, options_v=args.options_v,
+			options_a=args.options_a, timing=args.timing)
+
+	print("%d frames in %.1f s (%.2f fps)" % (stats["frames"], stats["elapsed"],
+			stats["fps"]))
+	print("Frame render time: avg %.3f s, median %.3f s, max %.3f s" % (
+			stats["render_avg"], stats["render_median"], stats["render_max"]))
+	print("Waiting for frames: %.1f s, writing to the encoder: %.1f s" % (
+			stats["wait"], stats["write"]))
+	print("Slowest frames:", " ".join(str(n) for n in stats["slowest"]))
+
+if __name__=="__main__":
+	main()
@@ -2,16 +2,22 @@ import vapoursynth as vs
 from vapoursynth import core
 import functions as f
 
+# Keep motion vectors on disk between runs (faster re-renders and previews)
+#f.mvstore(filename)
+
+# Time the stages and write where the render time goes (see profiler.py)
+#f.profile("profile.txt", "profile.folded")
+
 # Source
-clip = core.lsmas.LWLibavSource(filename, repeat=1)
+clip = f.source(filename, repeat=1)
 
 # Process
-clip = core.vivtc.VFM(clip, order=0)
+clip = f.stage(core.vivtc.VFM(clip, order=0), "VFM")
 clip = f.fixfieldjitter(clip)
 clip = core.lghost.LGhost(clip, 3, -2, 50)
-clip = core.lghost.LGhost(clip, 4, 2, -50)
+clip = f.stage(core.lghost.LGhost(clip, 4, 2, -50), "LGhost")
 clip = f.denoise(clip, 8, 8, 2, 300, 400)
-clip = core.asharp.ASharp(clip, 2, 16, 4)
+clip = f.stage(core.asharp.ASharp(clip, 2, 16, 4), "ASharp")
 
 # Output
 clip.set_output()
@@ -1,6 +1,6 @@
 #!/bin/sh
 # (copyleft) Efenstor 2015-2025
-# Revision 2025-11-11
+# Revision 2026-10-18
 
 # Examples:
 # ffmpeg_options_v="-c:v libx264 -crf 16 -preset fast -tune film"
@@ -16,20 +16,27 @@ ffmpeg_options_a="-c:a aac -b:a 256k"
 dst_ext_default="mkv"
 threads=8
 thread_queue_size=256
+scene_threshold=0.3   # scene score of a scene cut for -c (0..1)
 vspath=/usr/local/lib/python3.11/site-packages
 
 # Internal defines
 export file_proc_vs_exit=
+SDIR="$( cd "$( dirname "$0" )" >/dev/null 2>&1 && pwd )"
 RED="\033[0;31m"
 GREEN="\033[0;32m"
 CYAN="\033[0;36m"
 YELLOW="\033[1;33m"
 NC="\033[0m"
 
+# Per-source probe and index cache
+. "$SDIR/cache.sh"
+
 # Parse the named parameters
-optstr="?he:d:a:pxnlf"
+optstr="?he:d:a:pxsnlfj:o:q:t:g:cT:"
 audio_track=0
 audio_delay=0
+jobs=1
+chunk_pad=0
 while getopts $optstr opt; do
   case "$opt" in
     e) dst_ext=$OPTARG
@@ -47,6 +54,9 @@ while getopts $optstr opt; do
     x) pause=true
        echo "Start preview in the paused state"
        ;;
+    s) seekable=true
+       echo "Seekable preview"
+       ;;
     n) no_audio=true
        echo "Without audio"
        ;;
@@ -56,6 +66,33 @@ while getopts $optstr opt; do
     f) fast_time=true
        echo "Using fast and crude time to frame number conversion"
        ;;
+    j) jobs=$OPTARG
+       echo "Parallel jobs: $jobs"
+       ;;
+    o) chunk_pad=$OPTARG
+       echo "Chunk padding: $chunk_pad frames"
+       ;;
+    q) queue_dir=$OPTARG
+       echo "Work queue: $queue_dir"
+       ;;
+    t) threads=$OPTARG
+       echo "VapourSynth threads: $threads"
+       ;;
+    g) segment=$OPTARG
+       echo "Segment length: $segment frames"
+       ;;
+    c) snap_cuts=true
+       echo "Chunk boundaries at scene cuts"
+       ;;
+    T) case "$OPTARG" in
+         draft|normal|final) ;;
+         *) echo "Unknown tier: $OPTARG (draft, normal or final)" >&2
+            exit 1
+            ;;
+       esac
+       export FPVS_TIER=$OPTARG
+       echo "Tier: $FPVS_TIER"
+       ;;
     :) echo "Missing argument for -$OPTARG" >&2
        exit 1
        ;;
@@ -77,11 +114,39 @@ Options:
                specified then <dst> will always be treated as a directory name
   -p           preview the output using mpv instead of doing conversion
   -x           start preview in the paused state
+  -s           seekable preview: the frames are rendered on demand and cached,
+               so seeking, pausing and rewinding do not restart the script
+               (preview.py)
   -n           do not process audio
   -d ms        audio delay in milliseconds
   -l           get audio delay from source file (-d delay will be added to it)
   -a num       audio track to use
   -f           use fast and crude time to frame number conversion (seconds*fps)
+               instead of the frame index (built once per source and cached)
+  -j jobs      encode in this number of chunks rendered by parallel vspipe and
+               ffmpeg processes, then join them without re-encoding
+  -o frames    with -j, render this number of extra frames before and after
+               each chunk and discard them; not needed for ordinary temporal
+               filters (every chunk process sees the whole clip), only for
+               scripts with filters whose output depends on the order in which
+               the frames are requested
+  -q queue_dir with -j or -g, share the chunks between any number of instances
+               started with the same parameters and queue_dir (on the same or
+               other hosts sharing the directories); each instance renders one
+               chunk at a time, the last one to finish joins them; the
+               finished chunks are remembered in queue_dir (for the same
+               script and options), delete queue_dir/done to encode them again
+  -g frames    encode in segments of this number of frames (rendered by -j
+               parallel processes), which are committed as soon as they are
+               finished; if the encoding is cancelled or crashes, running the
+               same command again continues from the finished segments
+  -c           with -j or -g, move the chunk boundaries to the nearest scene
+               cuts of the source (detected once per source and cached), if
+               the script keeps the number of frames
+  -T tier      speed/quality tier of the functions.py functions: draft,
+               normal or final (the default; see functions.py)
+  -t threads   number of VapourSynth threads (per chunk with -j), default is
+               $threads
 Parameters:
   <src_file>    source file to process and encode or preview
   <dst>         file or directory where the output file is to be placed;
@@ -135,9 +200,9 @@ if [ "$6" ]; then
 fi
 echo "Video start time: $video_start_time sec"
 if [ $audio_delay_auto ]; then
-  video_delay_base=$(ffprobe -show_entries stream -select_streams v:0 -i "$src_file" 2>&1 | sed -n "s/start_time=//p")
+  video_delay_base=$(cache_probe "$src_file" v:0 start_time)
   echo "Video delay in the input file: $video_delay_base sec"
-  audio_delay_base=$(ffprobe -show_entries stream -select_streams a:0 -i "$src_file" 2>&1 | sed -n "s/start_time=//p")
+  audio_delay_base=$(cache_probe "$src_file" a:0 start_time)
   echo "Audio delay in the input file: $audio_delay_base sec"
   audio_start_time=$(awk "BEGIN {print ($video_start_time)-($audio_delay_base)+($video_delay_base)+($audio_delay)}")
 else
@@ -158,7 +223,7 @@ if [ ! -e "$dst_dir" ] || [ ! -d "$dst_dir" ]; then
 fi
 
 # Extract audio (only if not already exists; useful for cancelled sessions)
-if [ ! $no_audio ]; then
+extract_audio() {
   if [ ! -e "$audio" ]; then
     echo "Extracting audio..."
     if [ $audio_track ]; then
@@ -172,21 +237,32 @@ if [ ! $no_audio ]; then
     printf "\n${YELLOW}WARNING: Not extracting audio as the temporary audio file already exists!
 Double-check if it contains the audio you wanted!${NC}\n"
   fi
+}
+# With a work queue it is done only by the instance which joins the chunks
+if [ ! $no_audio ]; then
+  if [ ! $queue_dir ] || { [ $jobs -le 1 ] && [ ! $segment ]; } || [ $mpv ]; then
+    extract_audio
+  fi
 fi
 
 # Find the start frame for the given start time
 echo "Start time: $video_start_time sec"
 if [ ! $start_frame ]; then
-  if [ ! $fast_time ]; then
-    # Precise calculation
+  if [ "$(awk "BEGIN {print ($video_start_time) <= 0}")" = 1 ]; then
+    start_frame=0
+  elif [ ! $fast_time ]; then
+    # Precise calculation: look up the cached frame index
     echo "Detecting the start frame for the given start time"
-    start_frame=$(ffmpeg -hide_banner -i "$src_file" \
-      -t $video_start_time -codec:v yuv4 -codec:a copy -f null /dev/null 2>&1 | \
-      sed -n "s/.*frame= *\([[:digit:]]*\).*/\1/p" | tail -n 1)
+    start_frame=$(cache_time_to_frame "$src_file" $video_start_time)
+    if [ ! "$start_frame" ]; then
+      # No timestamps, count the decoded frames
+      start_frame=$(ffmpeg -hide_banner -i "$src_file" \
+        -t $video_start_time -codec:v yuv4 -codec:a copy -f null /dev/null 2>&1 | \
+        sed -n "s/.*frame= *\([[:digit:]]*\).*/\1/p" | tail -n 1)
+    fi
   else
     # Fast calculation
-    fps=$(ffprobe -show_entries stream -select_streams v:0 -i "$src_file" 2>&1 | \
-      sed -n "s/avg_frame_rate=//p")
+    fps=$(cache_probe "$src_file" v:0 avg_frame_rate)
     start_frame=$(awk "BEGIN {print int(($video_start_time)*($fps))}")
   fi
 fi
@@ -196,8 +272,215 @@ if [ $end_frame ]; then
 fi
 echo
 
+# Render a chunk of frames into a separate file (run in the background by the
+# parallel encoding)
+# $1 = chunk number, $2 = first frame, $3 = last frame
+render_chunk() {
+  chunk_file="$chunk_dir/$(printf "%05d" $1).mkv"
+  # Padding frames are rendered but skipped before encoding
+  pad_start=$(( $2 - chunk_pad ))
+  if [ $pad_start -lt 0 ]; then pad_start=0; fi
+  pad_end=$(( $3 + chunk_pad ))
+  if [ $pad_end -ge $num_frames ]; then pad_end=$(( num_frames - 1 )); fi
+  skip=$(( $2 - pad_start ))
+  skip_time=
+  if [ $skip -gt 0 ]; then
+    skip_time=$(awk "BEGIN {print ($skip-0.5)*($fps_den)/($fps_num)}")
+  fi
+  env ${vspath:+PYTHONPATH="$vspath":}"$PWD" vspipe -a filename="$src_file" \
+    -c y4m "$script" -r $threads -s $pad_start -e $pad_end - | \
+    ffmpeg -nostdin -hide_banner -loglevel error \
+    -thread_queue_size $thread_queue_size -i pipe: ${skip_time:+-ss $skip_time} \
+    -frames:v $(( $3 - $2 + 1 )) $ffmpeg_options_v -an \
+    -f matroska -y "$chunk_file.part"
+  if [ $? -ne 0 ]; then return 1; fi
+  # Commit
+  mv "$chunk_file.part" "$chunk_file"
+  echo "$(basename "$chunk_file") $2 $3" >> "$chunk_dir/manifest"
+  echo "Chunk $1 (frames $2-$3) done"
+}
+
+# Check if a chunk has been committed
+# $1 = chunk number
+chunk_done() {
+  [ -e "$chunk_dir/$(printf "%05d" $1).mkv" ] && \
+    grep -q "^$(printf "%05d" $1).mkv " "$chunk_dir/manifest" 2>/dev/null
+}
+
 # Process video (and mux with audio)
-if [ ! $mpv ]; then
+if [ ! $mpv ] && { [ $jobs -gt 1 ] || [ $segment ]; }; then
+  # Get the output clip length and frame rate
+  vs_info=$(env ${vspath:+PYTHONPATH="$vspath":}"$PWD" vspipe \
+    -a filename="$src_file" --info "$script" - 2>&1)
+  num_frames=$(echo "$vs_info" | sed -n "s/^Frames: *\([0-9]*\).*/\1/p")
+  fps_num=$(echo "$vs_info" | sed -n "s/^FPS: *\([0-9]*\)\/.*/\1/p")
+  fps_den=$(echo "$vs_info" | sed -n "s/^FPS: *[0-9]*\/\([0-9]*\).*/\1/p")
+  if [ ! "$num_frames" ]; then
+    printf "${RED}Cannot get the output clip info:${NC}\n%s\n" "$vs_info" >&2
+    export file_proc_vs_exit=1; exit 1
+  fi
+  last_frame=${end_frame:-$(( num_frames - 1 ))}
+  total=$(( last_frame - start_frame + 1 ))
+  if [ $segment ]; then
+    num_chunks=$(( (total + segment - 1) / segment ))
+  else
+    num_chunks=$jobs
+  fi
+  if [ $num_chunks -gt $total ]; then num_chunks=$total; fi
+  if [ $jobs -gt $num_chunks ]; then jobs=$num_chunks; fi
+  chunk_dir="$dst.chunks"
+  i=0
+  chunk_list=
+  while [ $i -lt $num_chunks ]; do
+    if [ $segment ]; then
+      first=$(( start_frame + segment*i ))
+      last=$(( first + segment - 1 ))
+      if [ $last -gt $last_frame ]; then last=$last_frame; fi
+    else
+      first=$(( start_frame + total*i/num_chunks ))
+      last=$(( start_frame + total*(i+1)/num_chunks - 1 ))
+    fi
+    chunk_list="$chunk_list $i:$first:$last"
+    i=$(( i + 1 ))
+  done
+  # Move every chunk boundary to the nearest scene cut within a quarter of the
+  # shorter of the two chunks
+  if [ $snap_cuts ]; then
+    index=$(cache_frames "$src_file")
+    if [ $? -ne 0 ] || [ $(wc -l < "$index") -ne $num_frames ]; then
+      printf "${YELLOW}WARNING: The script changes the number of frames or the source has no
+timestamps, the chunk boundaries are not moved to the scene cuts${NC}\n"
+    elif cuts=$(cache_scenecuts "$src_file" $scene_threshold); then
+      chunk_list=$(echo $chunk_list | tr " " "\n" | awk -F: '
+        FNR == NR { cut[m++] = $1; next }
+        { first[n] = $2; last[n++] = $3 }
+        END {
+          j = 0
+          for (i = 1; i < n; i++) {
+            w = last[i] - first[i]
+            if (last[i - 1] - first[i - 1] < w) w = last[i - 1] - first[i - 1]
+            w = int((w + 1) / 4)
+            best = first[i]
+            bestd = w + 1
+            while (j < m && cut[j] < first[i] - w) j++
+            for (k = j; k < m && cut[k] <= first[i] + w; k++) {
+              d = cut[k] - first[i]
+              if (d < 0) d = -d
+              if (cut[k] > first[i - 1] && d < bestd) { best = cut[k]; bestd = d }
+            }
+            first[i] = best
+            last[i - 1] = best - 1
+          }
+          for (i = 0; i < n; i++) printf "%d:%d:%d ", i, first[i], last[i]
+        }' "$cuts" -)
+      echo "Chunks: $chunk_list"
+    fi
+  fi
+  if [ ! $queue_dir ]; then
+    # The first line of the manifest identifies the encoding, the committed
+    # chunks are listed below it; resume only if nothing has been changed
+    manifest_id="$src_file|$(cksum < "$script")|$chunk_list|$chunk_pad|$ffmpeg_options_v|$FPVS_TIER|$FPVS_MVPROXY"
+    if [ -e "$chunk_dir/manifest" ] && \
+      [ "$(head -n 1 "$chunk_dir/manifest")" = "$manifest_id" ]; then
+      rm -f "$chunk_dir"/*.part
+      done_chunks=0
+      for c in $chunk_list; do
+        if chunk_done ${c%%:*}; then done_chunks=$(( done_chunks + 1 )); fi
+      done
+      echo "Resuming: $done_chunks of $num_chunks chunks already encoded"
+    else
+      rm -rf "$chunk_dir"
+      mkdir "$chunk_dir"
+      echo "$manifest_id" > "$chunk_dir/manifest"
+    fi
+    # Encode the chunks in parallel, every job takes every jobs-th chunk
+    echo "Encoding $num_chunks chunks in $jobs parallel jobs..."
+    pids=
+    trap 'for p in $pids; do pkill -P $p; kill $p; done 2>/dev/null' INT TERM
+    w=0
+    while [ $w -lt $jobs ]; do
+      (
+        for c in $chunk_list; do
+          n=${c%%:*}
+          if [ $(( n % jobs )) -ne $w ] || chunk_done $n; then continue; fi
+          render_chunk $(echo $c | tr ":" " ") || exit 1
+        done
+      ) &
+      pids="$pids $!"
+      w=$(( w + 1 ))
+    done
+    failed=
+    for p in $pids; do
+      wait $p || failed=true
+    done
+    wait
+    trap - INT TERM
+    # Cancelled
+    if [ $failed ]; then export file_proc_vs_exit=1; exit 1; fi
+  else
+    # Take the chunks from the work queue until all of them are done
+    . "$SDIR/queue.sh"
+    queue_init "$queue_dir"
+    mkdir -p "$chunk_dir"
+    # The chunks done with other parameters are not reused
+    queue_prefix="$(basename "$dst")@$start_frame-$last_frame/$num_chunks"
+    queue_prefix="$queue_prefix#$(echo "$(basename "$src_file")|$(cksum < "$script")|$chunk_list|$chunk_pad|$ffmpeg_options_v|$ffmpeg_options_a|$no_audio|$FPVS_TIER|$FPVS_MVPROXY" | queue_key)"
+    echo "Encoding $num_chunks chunks through the work queue..."
+    while true; do
+      remaining=
+      for c in $chunk_list; do
+        item="$queue_prefix:${c%%:*}"
+        if queue_isdone "$queue_dir" "$item"; then continue; fi
+        remaining=true
+        if ! queue_claim "$queue_dir" "$item"; then continue; fi
+        render_chunk $(echo $c | tr ":" " ")
+        # Cancelled
+        if [ $? -ne 0 ]; then
+          queue_release "$queue_dir" "$item"
+          export file_proc_vs_exit=1; exit 1
+        fi
+        queue_done "$queue_dir" "$item"
+      done
+      if [ ! $remaining ]; then break; fi
+      # Chunks still being rendered by others, wait for them to finish or crash
+      sleep $queue_heartbeat
+    done
+    # Only one instance joins the chunks
+    if ! queue_claim "$queue_dir" "$queue_prefix:join"; then
+      echo "The chunks are joined by another instance"
+      exit
+    fi
+    if [ ! $no_audio ]; then
+      extract_audio
+    fi
+  fi
+  for c in $chunk_list; do
+    echo "file '$(printf "%05d" ${c%%:*}).mkv'"
+  done > "$chunk_dir/list.txt"
+  # Remove the file if already exists
+  if [ -e "$dst" ] && [ -f "$dst" ]; then
+    rm "$dst"
+  fi
+  # Join the chunks (and mux with audio)
+  echo "Joining the chunks..."
+  if [ ! $no_audio ]; then
+    ffmpeg -f concat -safe 0 -i "$chunk_dir/list.txt" \
+      -ss $audio_start_time -i "$audio" -map 0:v:0 -map 1:a:0 \
+      -c:v copy $ffmpeg_options_a "$dst"
+  else
+    ffmpeg -f concat -safe 0 -i "$chunk_dir/list.txt" -c:v copy -an "$dst"
+  fi
+  # Cancelled
+  if [ $? -ne 0 ]; then export file_proc_vs_exit=1; exit 1; fi
+  # Remove the temporary files
+  rm -r "$chunk_dir"
+  if [ ! $no_audio ]; then
+    rm "$audio"
+  fi
+  if [ $queue_dir ]; then
+    queue_done "$queue_dir" "$queue_prefix:join"
+  fi
+elif [ ! $mpv ]; then
   # Remove the file if already exists
   if [ -e "$dst" ] && [ -f "$dst" ]; then
     rm "$dst"
@@ -227,7 +510,17 @@ if [ ! $mpv ]; then
 else
   # Preview
   echo "Preview..."
-  if [ ! $no_audio ]; then
+  if [ $seekable ]; then
+    # Seekable, the script runs in preview.py
+    if [ ! $no_audio ]; then
+      set -- -a "$audio" -d $audio_start_time
+    else
+      set --
+    fi
+    env ${vspath:+PYTHONPATH="$vspath":}"$PWD" python3 "$SDIR/preview.py" \
+      -s $start_frame ${end_frame:+-e $end_frame} -r $threads ${pause:+-x} \
+      "$@" "$src_file" "$script"
+  elif [ ! $no_audio ]; then
     # With audio
     env ${vspath:+PYTHONPATH="$vspath":}"$PWD" vspipe -a filename="$src_file" \
       -c y4m "$script" -p -r $threads -s $start_frame \
@@ -1,5 +1,6 @@
 #!/bin/sh
 # Copyleft 2020-2023 Efenstor
+# Revision 2026-10-18
 
 ffmpeg_options_out="-c:v h264 -crf 15 -an"
 src_format="%08d"
@@ -11,11 +12,29 @@ CYAN="\033[0;36m"
 YELLOW="\033[1;33m"
 NC="\033[0m"
 
+# Parse the named parameters
+optstr="?j:"
+jobs=1
+while getopts $optstr opt; do
+  case "$opt" in
+    j) jobs=$OPTARG
+       ;;
+    :) echo "Missing argument for -$OPTARG" >&2
+       exit 1
+       ;;
+  esac
+done
+shift $((OPTIND - 1))
+
 # Show help
 if [ $# -lt 4 ]; then
   printf "\n${YELLOW}Convert frame image files to a video file using ffmpeg
 ${GREEN}(copyleft) Efenstor${NC}\n
-Usage: frames_to_video.sh <images_dir> <images_ext> <dst_file> <fps>
+Usage: frames_to_video.sh [options] <images_dir> <images_ext> <dst_file> <fps>
+Options:
+  -j jobs     encode this number of parts of the frame sequence by parallel
+              ffmpeg processes, then join them without re-encoding (the frames
+              must be numbered without gaps)
 Parameters:
   images_dir  directory with frame image files
   images_ext  image file extension (e.g. png)
@@ -31,6 +50,65 @@ src_ext="$2"
 dst_file="$3"
 dst_fps=$4
 
-# Do the job
-ffmpeg -loglevel info -i "$src_dir/$src_format.$src_ext" $ffmpeg_options_out -vf fps=$dst_fps $dst_file
+# Single process
+if [ $jobs -le 1 ]; then
+  # Do the job
+  ffmpeg -loglevel info -framerate $dst_fps -i "$src_dir/$src_format.$src_ext" \
+    $ffmpeg_options_out "$dst_file"
+  exit
+fi
+
+# Numbers of the first and the last frame
+frames=$(find "$src_dir" -maxdepth 1 -type f -name "[0-9]*.$src_ext" | sort)
+num_frames=$(echo "$frames" | grep -c .)
+if [ $num_frames -eq 0 ]; then
+  echo "No frames found" >&2
+  exit 1
+fi
+first=$(basename "$(echo "$frames" | head -n 1)" ".$src_ext")
+last=$(basename "$(echo "$frames" | tail -n 1)" ".$src_ext")
+first=$(expr "$first" + 0)
+last=$(expr "$last" + 0)
+if [ $(( last - first + 1 )) -ne $num_frames ]; then
+  echo "There are gaps in the frame numbering, use a single job" >&2
+  exit 1
+fi
+if [ $jobs -gt $num_frames ]; then jobs=$num_frames; fi
+
+# Encode the parts in parallel, each part starts with a keyframe
+part_dir="$dst_file.parts"
+part_ext="${dst_file##*.}"
+rm -rf "$part_dir"
+mkdir "$part_dir"
+echo "Encoding $num_frames frames in $jobs parts..."
+pids=
+trap 'for p in $pids; do kill $p; done 2>/dev/null' INT TERM
+i=0
+while [ $i -lt $jobs ]; do
+  start=$(( first + num_frames * i / jobs ))
+  end=$(( first + num_frames * (i + 1) / jobs ))
+  ffmpeg -nostdin -loglevel error -y -framerate $dst_fps -start_number $start \
+    -i "$src_dir/$src_format.$src_ext" -frames:v $(( end - start )) \
+    $ffmpeg_options_out "$part_dir/$(printf "%05d" $i).$part_ext" &
+  pids="$pids $!"
+  echo "file '$(printf "%05d" $i).$part_ext'" >> "$part_dir/list.txt"
+  i=$(( i + 1 ))
+done
+failed=
+for p in $pids; do
+  wait $p || failed=true
+done
+trap - INT TERM
+# Cancelled
+if [ $failed ]; then
+  printf "${RED}Encoding failed or cancelled${NC}\n" >&2
+  rm -rf "$part_dir"
+  exit 1
+fi
 
+# Join the parts
+echo "Joining the parts..."
+ffmpeg -loglevel error -y -f concat -safe 0 -i "$part_dir/list.txt" -c copy \
+  "$dst_file"
+if [ $? -ne 0 ]; then exit 1; fi
+rm -rf "$part_dir"
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# FRAMESTORE.PY
+# Single-file store of raw video frames, an alternative to a directory of
+# image files for intermediate stages
+#
+# A store is a header (format, dimensions, frame rate, number of frames and
+# the offset of the index), the frames and the index, a table of the offsets
+# of the frames. The planes of a frame follow each other, their rows are
+# padded to 64 bytes like the rows of VapourSynth frames and every frame
+# starts at a page boundary, so that a frame is read from the memory map with
+# one copy per plane straight into a VapourSynth frame and nothing is decoded
+# or decompressed. (VapourSynth frames own their memory, so a copy from the
+# page cache is the least possible.)
+#
+# From Python:
+#   framestore.writeclip(clip, "stage1.fpvs")
+#   clip = functions.rawsource("stage1.fpvs")
+# From the shell:
+#   framestore.py import [-p pix_fmt] <video_file> <store>
+#   framestore.py export [-o ffmpeg_options] <store> <video_file>
+#   framestore.py info <store>
+#
+# Requirements: ffmpeg (import, export), VapourSynth (writeclip, rawsource)
+
+import argparse
+import ctypes
+import mmap
+import os
+import shlex
+import struct
+import subprocess
+import sys
+
+_magic = b"FPVSRAW\0"
+_version = 1
+# magic, version, width, height, color family, sample type, bits per sample,
+# subsampling w, subsampling h, fps num, fps den, frames, index offset
+_header = struct.Struct("<8sIIIIIIIIIIQQ")
+_header_size = 4096
+_page = 4096
+_row_align = 64
+
+# Color families and sample types as numbered by VapourSynth
+GRAY = 1
+RGB = 2
+YUV = 3
+INTEGER = 0
+FLOAT = 1
+
+# ffmpeg pixel formats: (color family, sample type, bits, subsampling w,
+# subsampling h, order of the ffmpeg planes in the store)
+pix_fmts = {
+	"gray": (GRAY, INTEGER, 8, 0, 0, (0,)),
+	"gray16le": (GRAY, INTEGER, 16, 0, 0, (0,)),
+	"yuv420p": (YUV, INTEGER, 8, 1, 1, (0, 1, 2)),
+	"yuv422p": (YUV, INTEGER, 8, 1, 0, (0, 1, 2)),
+	"yuv444p": (YUV, INTEGER, 8, 0, 0, (0, 1, 2)),
+	"yuv420p10le": (YUV, INTEGER, 10, 1, 1, (0, 1, 2)),
+	"yuv422p10le": (YUV, INTEGER, 10, 1, 0, (0, 1, 2)),
+	"yuv444p10le": (YUV, INTEGER, 10, 0, 0, (0, 1, 2)),
+	"yuv420p16le": (YUV, INTEGER, 16, 1, 1, (0, 1, 2)),
+	"yuv444p16le": (YUV, INTEGER, 16, 0, 0, (0, 1, 2)),
+	# ffmpeg orders the planes G, B, R
+	"gbrp": (RGB, INTEGER, 8, 0, 0, (1, 2, 0)),
+	"gbrp16le": (RGB, INTEGER, 16, 0, 0, (1, 2, 0)),
+	"gbrpf32le": (RGB, FLOAT, 32, 0, 0, (1, 2, 0)),
+}
+
+def _align(n, a):
+
+	return (n+a-1)//a*a
+
+# Layout of the planes of a frame as a list of (row bytes, stride, height)
+def planelayout(width, height, family, bits, ssw, ssh):
+
+	bps = (bits+7)//8
+	layout = []
+	for p in range(1 if family==GRAY else 3):
+		w = width if p==0 or family!=YUV else width>>ssw
+		h = height if p==0 or family!=YUV else height>>ssh
+		layout.append((w*bps, _align(w*bps, _row_align), h))
+
+	return layout
+
+
+#--------
+# Writer
+#--------
+
+class Writer:
+
+	def __init__(self, path, width, height, family, sampletype, bits, ssw=0,
+			ssh=0, fpsnum=0, fpsden=1):
+
+		self.path = path
+		self.fields = [width, height, family, sampletype, bits, ssw, ssh, fpsnum,
+				fpsden]
+		self.layout = planelayout(width, height, family, bits, ssw, ssh)
+		self.framesize = _align(sum(s*h for r, s, h in self.layout), _page)
+		self.offsets = []
+		self.file = open(path+".part", "wb")
+		self.file.write(bytes(_header_size))
+
+	# Write a frame given as a list of planes, each either packed (rows without
+	# padding) or with the rows padded to the stride of the store
+	def write(self, planes):
+
+		start = self.file.tell()
+		for data, (row, stride, height) in zip(planes, self.layout):
+			data = memoryview(data).cast("B")
+			if len(data)==stride*height:
+				self.file.write(data)
+			else:
+				pad = bytes(stride-row)
+				for y in range(height):
+					self.file.write(data[y*row:(y+1)*row])
+					self.file.write(pad)
+		self.file.write(bytes(start+self.framesize-self.file.tell()))
+		self.offsets.append(start)
+
+	# Write a frame in the packed planar layout of ffmpeg rawvideo
+	# order: order of the planes of the data in the store (see pix_fmts)
+	def writeraw(self, data, order=(0, 1, 2)):
+
+		data = memoryview(data).cast("B")
+		planes = [None]*len(self.layout)
+		pos = 0
+		for p in order[:len(self.layout)]:
+			row, stride, height = self.layout[p]
+			planes[p] = data[pos:pos+row*height]
+			pos += row*height
+		self.write(planes)
+
+	def close(self):
+
+		index = self.file.tell()
+		self.file.write(struct.pack("<%dQ" % len(self.offsets), *self.offsets))
+		self.file.seek(0)
+		self.file.write(_header.pack(_magic, _version, *self.fields,
+				len(self.offsets), index))
+		self.file.close()
+		os.replace(self.path+".part", self.path)
+
+	def abort(self):
+
+		self.file.close()
+		os.remove(self.path+".part")
+
+
+#------------
+# FrameStore
+#------------
+
+class FrameStore:
+
+	def __init__(self, path):
+
+		with open(path, "rb") as f:
+			# a private mapping: never written, but ctypes can take addresses in it
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+		(magic, version, self.width, self.height, self.family, self.sampletype,
+				self.bits, self.ssw, self.ssh, self.fpsnum, self.fpsden,
+				self.num_frames, index) = _header.unpack_from(self.data)
+		if magic!=_magic or version!=_version:
+			raise ValueError("%s: not a frame store" % path)
+		self.offsets = struct.unpack_from("<%dQ" % self.num_frames, self.data,
+				index)
+		self.layout = planelayout(self.width, self.height, self.family, self.bits,
+				self.ssw, self.ssh)
+		self.base = ctypes.addressof(ctypes.c_char.from_buffer(self.data))
+
+	# Plane data of a frame as a list of (address, stride, height)
+	def planes(self, n):
+
+		pos = self.offsets[n]
+		planes = []
+		for row, stride, height in self.layout:
+			planes.append((self.base+pos, stride, height))
+			pos += stride*height
+
+		return planes
+
+	# Plane data of a frame as a list of memoryviews (rows padded to the stride)
+	def planedata(self, n):
+
+		pos = self.offsets[n]
+		views = []
+		for row, stride, height in self.layout:
+			views.append(memoryview(self.data)[pos:pos+stride*height])
+			pos += stride*height
+
+		return views
+
+	# Copy a frame to a writable VapourSynth frame of the same format
+	def copyto(self, n, f):
+
+		for p, (src, stride, height) in enumerate(self.planes(n)):
+			dst = f.get_write_ptr(p).value
+			dst_stride = f.get_stride(p)
+			if dst_stride==stride:
+				ctypes.memmove(dst, src, stride*height)
+			else:
+				row = self.layout[p][0]
+				for y in range(height):
+					ctypes.memmove(dst+y*dst_stride, src+y*stride, row)
+
+
+# Write all the frames of a VapourSynth clip to a store
+def writeclip(clip, path):
+
+	fmt = clip.format
+	w = Writer(path, clip.width, clip.height, int(fmt.color_family),
+			int(fmt.sample_type), fmt.bits_per_sample, fmt.subsampling_w,
+			fmt.subsampling_h, clip.fps.numerator, clip.fps.denominator)
+	try:
+		for f in clip.frames():
+			planes = []
+			for p, (row, stride, height) in enumerate(w.layout):
+				src = f.get_read_ptr(p).value
+				src_stride = f.get_stride(p)
+				if src_stride==stride:
+					planes.append(ctypes.string_at(src, stride*height))
+				else:
+					planes.append(b"".join(ctypes.string_at(src+y*src_stride, row)
+							for y in range(height)))
+			w.write(planes)
+	except BaseException:
+		w.abort()
+		raise
+	w.close()
+
+
+#-----
+# CLI
+#-----
+
+def _importvideo(src, path, pix_fmt):
+
+	import sourcecache
+	family, sampletype, bits, ssw, ssh, order = pix_fmts[pix_fmt]
+	props = sourcecache.probe(src)
+	rate = props.get("avg_frame_rate", "0/0")
+	if rate.startswith("0"): rate = props["r_frame_rate"]
+	fpsnum, fpsden = (int(x) for x in rate.split("/"))
+	w = Writer(path, int(props["width"]), int(props["height"]), family,
+			sampletype, bits, ssw, ssh, fpsnum, fpsden)
+	size = sum(row*h for row, s, h in w.layout)
+	decoder = subprocess.Popen(["ffmpeg", "-nostdin", "-hide_banner",
+			"-loglevel", "error", "-i", src, "-map", "0:v:0", "-f", "rawvideo",
+			"-pix_fmt", pix_fmt, "pipe:"], stdout=subprocess.PIPE)
+	try:
+		while True:
+			data = decoder.stdout.read(size)
+			if len(data)<size:
+				break
+			w.writeraw(data, order)
+			print("\rFrames: %d" % len(w.offsets), end="", file=sys.stderr)
+		print(file=sys.stderr)
+		if decoder.wait()!=0:
+			raise RuntimeError("decoding failed")
+	except BaseException:
+		decoder.kill()
+		w.abort()
+		raise
+	w.close()
+
+def _exportvideo(path, dst, options):
+
+	store = FrameStore(path)
+	key = (store.family, store.sampletype, store.bits, store.ssw, store.ssh)
+	for pix_fmt, fmt in pix_fmts.items():
+		if fmt[:5]==key: break
+	else:
+		raise ValueError("no ffmpeg pixel format for the format of the store")
+	order = pix_fmts[pix_fmt][5]
+	encoder = subprocess.Popen(["ffmpeg", "-hide_banner", "-loglevel", "error",
+			"-y", "-f", "rawvideo", "-pix_fmt", pix_fmt, "-s", "%dx%d" %
+			(store.width, store.height), "-r", "%d/%d" % (store.fpsnum,
+			store.fpsden or 1), "-i", "pipe:"]+shlex.split(options)+[dst],
+			stdin=subprocess.PIPE)
+	try:
+		for n in range(store.num_frames):
+			views = store.planedata(n)
+			for p in order[:len(views)]:
+				row, stride, height = store.layout[p]
+				if row==stride:
+					encoder.stdin.write(views[p])
+				else:
+					for y in range(height):
+						encoder.stdin.write(views[p][y*stride:y*stride+row])
+		encoder.stdin.close()
+	except BaseException:
+		encoder.kill()
+		raise
+	if encoder.wait()!=0:
+		raise RuntimeError("encoding failed")
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Single-file store of raw "
+			"video frames")
+	sub = parser.add_subparsers(dest="command", required=True)
+	p = sub.add_parser("import", help="decode a video file into a store")
+	p.add_argument("src_file")
+	p.add_argument("store")
+	p.add_argument("-p", "--pix-fmt", default="yuv420p", choices=sorted(pix_fmts),
+			help="ffmpeg pixel format of the frames (default: %(default)s)")
+	p = sub.add_parser("export", help="encode a store into a video file")
+	p.add_argument("store")
+	p.add_argument("dst_file")
+	p.add_argument("-o", "--options", default="-c:v libx264 -crf 16",
+			help="ffmpeg encoding options (default: %(default)s)")
+	p = sub.add_parser("info", help="show the format of a store")
+	p.add_argument("store")
+	args = parser.parse_args()
+
+	try:
+		if args.command=="import":
+			_importvideo(args.src_file, args.store, args.pix_fmt)
+		elif args.command=="export":
+			_exportvideo(args.store, args.dst_file, args.options)
+		else:
+			s = FrameStore(args.store)
+			family = {GRAY: "GRAY", RGB: "RGB", YUV: "YUV"}.get(s.family, "?")
+			print("%dx%d %s%d%s ss %d/%d, %d frames at %d/%d fps" % (s.width,
+					s.height, family, s.bits, "f" if s.sampletype==FLOAT else "",
+					s.ssw, s.ssh, s.num_frames, s.fpsnum, s.fpsden))
+	except KeyboardInterrupt:
+		print("\nAbort", file=sys.stderr)
+		sys.exit(1)
+
+if __name__=="__main__":
+	main()
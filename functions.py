@@ -4,6 +4,8 @@
 import vapoursynth as vs
 from vapoursynth import core
 import functools
+import os
+import sys
 
 #-------------
 # TVRange
@@ -46,60 +48,381 @@ def ivtc(clip):
 	return clip
 
 
+#--------
+# Source
+#--------
+# LWLibavSource with its index file kept in the shared per-source cache (see
+# sourcecache.py) instead of next to the source, so the source directory may
+# be read-only and every tool and batch job reuses the same index
+# Requirements: L-SMASH Source
+
+def source(filename, **args):
+
+	import sourcecache
+	args["cachefile"] = sourcecache.cachefile(filename, "lwi", ".lwi")
+
+	return core.lsmas.LWLibavSource(filename, **args)
+
+
+#-----------
+# RawSource
+#-----------
+# Frames of a raw frame store (see framestore.py), copied from the memory map
+# into the frames without decoding, with random access at memory speed
+# Requirements: none
+
+def rawsource(path):
+
+	import framestore
+	store = framestore.FrameStore(path)
+	fmt = core.query_video_format(store.family, store.sampletype, store.bits,
+			store.ssw, store.ssh)
+	blank = core.std.BlankClip(width=store.width, height=store.height,
+			format=fmt.id, length=store.num_frames, fpsnum=store.fpsnum,
+			fpsden=store.fpsden or 1, keep=True)
+
+	def read(n, f):
+		fout = f.copy()
+		store.copyto(n, fout)
+		return fout
+
+	return core.std.ModifyFrame(blank, blank, read)
+
+
+#------------
+# RGB domain
+#------------
+# The functions working in RGBS (srmdsharpen, neuralupscale, rife,
+# deaberration) convert their input with _torgbs and their output back with
+# _fromrgbs. A clip returned by _fromrgbs remembers the RGBS clip it was
+# converted from and _torgbs takes that one instead of converting again, so in
+# a chain like deaberration -> rife the frames stay in RGBS: the YUV clip in
+# between is never rendered unless something else requests it. It also saves
+# the rounding of the round trip.
+# Requirements: none
+
+_rgbparents = {}
+
+# resample: resizer used for the conversion, args: its other arguments
+# (e.g. a new size)
+def _torgbs(clip, resample=None, **args):
+
+	if resample==None: resample = core.resize.Bicubic
+	entry = _rgbparents.get(id(clip))
+	# other arguments (e.g. range) change the conversion, then it is done again
+	if entry!=None and set(args)<={"width", "height"}:
+		rgbs = entry[1]
+		if args:
+			rgbs = resample(rgbs, width=args.get("width", rgbs.width),
+					height=args.get("height", rgbs.height))
+		return rgbs
+
+	return resample(clip, format=vs.RGBS, matrix_in_s="709", **args)
+
+def _fromrgbs(rgbs, fmt, resample=None, **args):
+
+	if resample==None: resample = core.resize.Bicubic
+	clip = resample(rgbs, format=fmt, matrix_s="709", **args)
+	# the parent has the size of the clip
+	if "width" in args or "height" in args:
+		rgbs = resample(rgbs, width=clip.width, height=clip.height)
+	# keep the clip referenced so that its id cannot be reused
+	_rgbparents[id(clip)] = (clip, rgbs)
+
+	return clip
+
+
+#-----------------
+# Motion analysis
+#-----------------
+# Memoized Super/Analyse/Recalculate used by all the MVTools-based functions.
+# The nodes are cached by the input clip(s) and parameters, so when several
+# functions (or the same function twice, like in denoise2) analyse the same
+# clip with the same parameters the motion search is done only once.
+# mvclear() drops the cache (only needed in long-lived processes, e.g. an
+# editor re-evaluating the script).
+# mvstore(filename) enables the persistent vector store (see vectorstore.py):
+# all the vectors computed by the script are saved on disk and are read back
+# instead of being searched again in the next runs on the same source, e.g.
+# when only thsad/thsadc were changed. Call it before any processing:
+#   f.mvstore(filename)
+# The FPVS_MVSTORE_CLEAR environment variable (or clear=True) discards the
+# previously stored vectors.
+# mvproxy(factor) makes the searches with recalculations (recalc>0) start on a
+# copy of the clip downscaled by factor, with the block size divided by
+# factor, the vectors are then scaled back (mv.ScaleVect, MVTools v24 or
+# newer) and only the recalculations are done at full resolution. Applies to
+# all the functions below that use recalc (denoise, flowfps2, addblur2,
+# denoise3), their proxy parameter overrides it for a single call. The
+# FPVS_MVPROXY environment variable sets it without editing the script.
+# Requirements: MVTools or MVTools-Float
+
+_mvcache = {}
+_mvdescs = {}
+_mvprints = {}
+_mvsupers = {}
+_mvstore = None
+_mvproxy = int(os.environ.get("FPVS_MVPROXY", 1))
+
+# Fingerprint of the content of a clip for the store, rendered once per clip
+# (the clip is kept referenced by the cache entry it goes into)
+def _mvprint(node):
+
+	if id(node) not in _mvprints:
+		_mvprints[id(node)] = _mvstore.fingerprint(node)
+
+	return _mvprints[id(node)]
+
+def _mvdesc(node):
+
+	if id(node) in _mvdescs:
+		return _mvdescs[id(node)]
+	# external super clip
+	desc = "ext:%s:%d:%d" % (node.format.name, node.width, node.height)
+	if _mvstore!=None:
+		desc += ":" + _mvprint(node)
+	# the node is kept referenced by the cache entry it goes into
+	_mvdescs[id(node)] = desc
+
+	return desc
+
+def _mvcached(name, refs, args):
+
+	key = (name,) + tuple(id(r) for r in refs) + tuple(sorted(
+			(k, tuple(v) if isinstance(v, list) else v) for k, v in args.items()))
+	if key not in _mvcache:
+		node = getattr(core.mv, name)(*refs, **args)
+		desc = "%s(%s;%s)" % (name, ",".join(_mvdesc(r) for r in refs),
+				",".join("%s=%s" % kv for kv in key[len(refs)+1:]))
+		if _mvstore!=None:
+			if name=="Super":
+				desc += ":" + _mvprint(refs[0])
+			else:
+				node = _mvstore.wrap(node, desc)
+		# keep the input clips referenced so their ids cannot be reused
+		_mvcache[key] = (refs, node)
+		_mvdescs[id(node)] = desc
+
+	return _mvcache[key][1]
+
+# Drop the cached nodes and frames (also the remap tables, the RGBS parents
+# and the scene cuts, see remap, _torgbs and scenes), e.g. before building
+# another script in the same process
+def mvclear():
+
+	global _scenecuts
+	_mvcache.clear()
+	_mvdescs.clear()
+	_mvprints.clear()
+	_mvsupers.clear()
+	_remaps.clear()
+	_rgbparents.clear()
+	_scenecuts = None
+
+def mvstore(filename, path=None, clear=False):
+
+	global _mvstore
+	import vectorstore
+	_mvstore = vectorstore.VectorStore(filename, path)
+	if clear or os.environ.get("FPVS_MVSTORE_CLEAR"):
+		_mvstore.clear()
+	# the nodes made so far are not backed by the store (the scene cuts and
+	# the other caches are kept)
+	_mvcache.clear()
+	_mvdescs.clear()
+	_mvprints.clear()
+	_mvsupers.clear()
+
+def mvproxy(factor=2):
+
+	global _mvproxy
+	_mvproxy = factor
+
+def mvsuper(clip, pel=2, **args):
+
+	args["pel"] = pel
+	sup = _mvcached("Super", [clip], args)
+	_mvsupers[id(sup)] = (clip, args)
+
+	return sup
+
+# Super clip of the clip of a super clip downscaled by factor, None if the
+# super clip was not made by mvsuper or the size is not divisible by factor
+def _mvproxysuper(sup, factor):
+
+	if id(sup) not in _mvsupers:
+		return None
+	clip, args = _mvsupers[id(sup)]
+	w = clip.width//factor
+	h = clip.height//factor
+	if w*factor!=clip.width or h*factor!=clip.height or \
+			w%(1<<clip.format.subsampling_w) or h%(1<<clip.format.subsampling_h):
+		return None
+	key = ("proxy", id(clip), factor)
+	if key not in _mvcache:
+		proxy = core.resize.Bicubic(clip, width=w, height=h)
+		_mvcache[key] = ([clip], proxy)
+		_mvdescs[id(proxy)] = "proxy(%s;%d)" % (_mvdesc(clip), factor)
+
+	return mvsuper(_mvcache[key][1], **args)
+
+def mvanalyse(sup, isb=False, delta=1, blksize=8, blksizev=None, overlap=0,
+		overlapv=None, **args):
+
+	if blksizev==None: blksizev = blksize
+	if overlapv==None: overlapv = overlap
+	args.update(isb=isb, delta=delta, blksize=blksize, blksizev=blksizev,
+			overlap=overlap, overlapv=overlapv)
+
+	return _mvcached("Analyse", [sup], args)
+
+def mvrecalculate(sup, vectors, blksize=8, blksizev=None, overlap=0,
+		overlapv=None, **args):
+
+	if blksizev==None: blksizev = blksize
+	if overlapv==None: overlapv = overlap
+	args.update(blksize=blksize, blksizev=blksizev, overlap=overlap,
+			overlapv=overlapv)
+
+	return _mvcached("Recalculate", [sup, vectors], args)
+
+# Analyse with optional recalculations
+# overlap: block size divider (e.g. for blksize=16 2 means 8)
+# recalc: number of recalculations, each one halves the block size (see
+#         denoise)
+# proxy: downscale factor of the initial search if recalc>0 (see mvproxy),
+#        None = the mvproxy setting
+
+def mvvectors(sup, isb, delta, blksizeX=8, blksizeY=8, overlap=2, recalc=0,
+		proxy=None):
+
+	if proxy==None: proxy = _mvproxy
+	bsX = blksizeX
+	bsY = blksizeY
+	if bsX>2: olX = int(bsX/overlap)
+	else: olX = 0
+	if bsY>2: olY = int(bsY/overlap)
+	else: olY = 0
+	psup = None
+	if proxy>1 and recalc>0 and bsX//proxy>=4 and bsY//proxy>=4:
+		psup = _mvproxysuper(sup, proxy)
+	if psup!=None:
+		if not hasattr(core.mv, "ScaleVect"):
+			raise vs.Error("mvvectors: proxy search needs mv.ScaleVect (MVTools "
+					"v24 or newer)")
+		vec = mvanalyse(psup, isb=isb, delta=delta, overlap=olX//proxy,
+				overlapv=olY//proxy, blksize=bsX//proxy, blksizev=bsY//proxy)
+		vec = _mvcached("ScaleVect", [vec], {"scale": proxy})
+	else:
+		vec = mvanalyse(sup, isb=isb, delta=delta, overlap=olX, overlapv=olY,
+				blksize=bsX, blksizev=bsY)
+
+	# do recalculations
+	for r in range(0, recalc):
+		bsX = bsX>>1
+		if bsX<4: break
+		bsY = bsY>>1
+		if bsY<4: break
+		olX = int(bsX/overlap)
+		olY = int(bsY/overlap)
+		vec = mvrecalculate(sup, vec, overlap=olX, overlapv=olY, blksize=bsX,
+				blksizev=bsY)
+
+	return vec
+
+# Backward and forward vectors for deltas 1..radius in the order expected by
+# Degrain1..3 (bw1, fw1, bw2, fw2, ...)
+
+def mvvectorset(sup, radius=3, blksizeX=8, blksizeY=8, overlap=2, recalc=0,
+		proxy=None):
+
+	vecs = []
+	for delta in range(1, radius+1):
+		vecs.append(mvvectors(sup, True, delta, blksizeX, blksizeY, overlap,
+				recalc, proxy))
+		vecs.append(mvvectors(sup, False, delta, blksizeX, blksizeY, overlap,
+				recalc, proxy))
+
+	return vecs
+
+
+#------------
+# Scene cuts
+#------------
+# scenes(filename) loads the scene cut index of the source (see
+# sourcecache.scenecuts, detected once per source and cached). After that the
+# degraining in denoise and denoise3 uses only the frames of the same scene:
+# near a cut the radius is reduced (down to no degraining on the first and
+# last frames of a scene), so no motion is searched and no frames are
+# averaged across the cuts. It is used only for clips with the same number of
+# frames as the source (before any trimming or frame rate changes). Call it
+# at the beginning of a script:
+#   f.scenes(filename)
+# Requirements: ffmpeg, MVTools or MVTools-Float
+
+_scenecuts = None
+_scenetotal = 0
+
+def scenes(filename, threshold=0.3):
+
+	global _scenecuts, _scenetotal
+	import sourcecache
+	_scenecuts = sourcecache.scenecuts(filename, threshold)
+	_scenetotal = len(sourcecache.timestamps(filename))
+
+# Degrain1..radius with the radius of every frame limited to its scene
+# vecs: bw1, fw1, bw2, fw2... (see mvvectorset)
+
+def _degrain(clip, sup, vecs, **args):
+
+	radius = len(vecs)//2
+	nodes = [getattr(core.mv, "Degrain%d" % r)(clip, sup, *vecs[:r*2], **args)
+			for r in range(1, radius+1)]
+	if not _scenecuts:
+		return nodes[-1]
+	if clip.num_frames!=_scenetotal:
+		# Trimmed or retimed, or a source filter that outputs other frames than
+		# the index has: the cuts would be on the wrong frames
+		if _scenetotal:
+			sys.stderr.write("scenes: the clip has %d frames, the scene index %d, "
+					"the scene cuts are not used\n" % (clip.num_frames, _scenetotal))
+		return nodes[-1]
+
+	import bisect
+	cuts = _scenecuts
+
+	def select(n):
+		i = bisect.bisect_right(cuts, n)
+		first = cuts[i-1] if i>0 else 0
+		end = cuts[i] if i<len(cuts) else clip.num_frames
+		r = min(radius, n-first, end-1-n)
+		return nodes[r-1] if r>0 else clip
+
+	return core.std.FrameEval(nodes[-1], select)
+
+
 #---------
 # Denoise
 #---------
 # recalc: number of recalculations (>0; e.g. for blksize=32 and recalc=3 block
 #         sizes will be 32,16,8,4 (the last three are the recalculations); for
 #         blksize=64 and recalc=1 those will be 32 and 16; etc.)
+# proxy: downscale factor of the initial search (see mvproxy; here and in
+#        flowfps2, addblur2 and denoise3)
+# radius: temporal radius (1..3, frames on each side; also in denoise3)
 # Requirements: MVTools or MVTools-Float
 
 def denoise(clip, blksizeX=8, blksizeY=8, overlap=2, thsad=200, thsadc=400,
-		ext_super=None, recalc=0):
-
-	if blksizeX>2: overlapX = int(blksizeX/overlap)
-	else: overlapX=0
-	if blksizeY>2: overlapY = int(blksizeY/overlap)
-	else: overlapY=0
+		ext_super=None, recalc=0, proxy=None, radius=3):
 
+	if radius<1 or radius>3:
+		raise vs.Error("denoise: radius must be 1..3")
 	if ext_super==None:
-		sup = core.mv.Super(clip)
+		sup = mvsuper(clip)
 	else:
 		sup = ext_super
 
-	mvbw1 = core.mv.Analyse(sup, isb=True, delta=1, overlap=overlapX,
-			overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-	mvfw1 = core.mv.Analyse(sup, isb=False, delta=1, overlap=overlapX,
-			overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-	mvbw2 = core.mv.Analyse(sup, isb=True, delta=2, overlap=overlapX,
-			overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-	mvfw2 = core.mv.Analyse(sup, isb=False, delta=2, overlap=overlapX,
-			overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-	mvbw3 = core.mv.Analyse(sup, isb=True, delta=3, overlap=overlapX,
-			overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-	mvfw3 = core.mv.Analyse(sup, isb=False, delta=3, overlap=overlapX,
-			overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-
-	# do recalculations
-	for r in range(0, recalc):
-		blksizeX = blksizeX>>1
-		if blksizeX<4: break
-		blksizeY = blksizeY>>1
-		if blksizeY<4: break
-		overlapX = int(blksizeX/overlap)
-		overlapY = int(blksizeY/overlap)
-		mvbw1 = core.mv.Recalculate(sup, mvbw1, overlap=overlapX,
-				overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-		mvfw1 = core.mv.Recalculate(sup, mvfw1, overlap=overlapX,
-				overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-		mvbw2 = core.mv.Recalculate(sup, mvbw2, overlap=overlapX,
-				overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-		mvfw2 = core.mv.Recalculate(sup, mvfw2, overlap=overlapX,
-				overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-		mvbw3 = core.mv.Recalculate(sup, mvbw3, overlap=overlapX,
-				overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
-		mvfw3 = core.mv.Recalculate(sup, mvfw3, overlap=overlapX,
-				overlapv=overlapY, blksize=blksizeX, blksizev=blksizeY)
+	vecs = mvvectorset(sup, radius, blksizeX, blksizeY, overlap, recalc, proxy)
 
 	# which planes are to process
 	if thsad==0:
@@ -110,8 +433,7 @@ def denoise(clip, blksizeX=8, blksizeY=8, overlap=2, thsad=200, thsadc=400,
 		plane = 4
 
 	# process
-	clip = core.mv.Degrain3(clip, sup, mvbw1, mvfw1, mvbw2, mvfw2, mvbw3, mvfw3,
-			thsad=thsad, thsadc=thsadc, plane=plane)
+	clip = _degrain(clip, sup, vecs, thsad=thsad, thsadc=thsadc, plane=plane)
 
 	return clip
 
@@ -121,18 +443,16 @@ def denoise(clip, blksizeX=8, blksizeY=8, overlap=2, thsad=200, thsadc=400,
 #---------
 # Requirements: MVTools or MVTools-Float
 
-def flowfps(clip, num=60000, den=1001, blksize=8, keepfps=False):
+def flowfps(clip, num=60000, den=1001, blksize=8, keepfps=False, pel=2):
 
 	src_fpsnum = clip.fps_num
 	src_fpsden = clip.fps_den
 
 	overlap = int(blksize/2)
 
-	sup = core.mv.Super(clip, pel=2)
-	mvbw1 = core.mv.Analyse(sup, isb=True, delta=1, overlap=overlap,
-			blksize=blksize)
-	mvfw1 = core.mv.Analyse(sup, isb=False, delta=1, overlap=overlap,
-			blksize=blksize)
+	sup = mvsuper(clip, pel=pel)
+	mvbw1 = mvanalyse(sup, isb=True, delta=1, overlap=overlap, blksize=blksize)
+	mvfw1 = mvanalyse(sup, isb=False, delta=1, overlap=overlap, blksize=blksize)
 	clip = core.mv.FlowFPS(clip, sup, mvbw1, mvfw1, num=num, den=den)
 
 	if keepfps:
@@ -146,35 +466,15 @@ def flowfps(clip, num=60000, den=1001, blksize=8, keepfps=False):
 #----------
 # Requirements: MVTools or MVTools-Float
 
-def flowfps2(clip, num=60000, den=1001, blksizeX=32, blksizeY=32, recalc=3, overlap=2, keepfps=False):
+def flowfps2(clip, num=60000, den=1001, blksizeX=32, blksizeY=32, recalc=3, overlap=2, keepfps=False, proxy=None):
 
 	src_fpsnum = clip.fps_num
 	src_fpsden = clip.fps_den
 
 	# analyze
-	bsX = blksizeX
-	bsY = blksizeY
-	if bsX>2: olX = int(bsX/overlap)
-	else: olX = 0
-	if bsY>2: olY = int(bsY/overlap)
-	else: olY = 0
-	sup = core.mv.Super(clip)
-	mvbw1 = core.mv.Analyse(sup, isb=True, delta=1, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	mvfw1 = core.mv.Analyse(sup, isb=False, delta=1, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	# do recalculations
-	for r in range(0, recalc):
-		bsX = bsX>>1
-		if bsX<4: break
-		bsY = bsY>>1
-		if bsY<4: break
-		olX = int(bsX/overlap)
-		olY = int(bsY/overlap)
-		mvbw1 = core.mv.Recalculate(sup, mvbw1, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
-		mvfw1 = core.mv.Recalculate(sup, mvfw1, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
+	sup = mvsuper(clip)
+	mvbw1, mvfw1 = mvvectorset(sup, 1, blksizeX, blksizeY, overlap, recalc,
+			proxy)
 
 	# process
 	clip = core.mv.FlowFPS(clip, sup, mvbw1, mvfw1, num=num, den=den)
@@ -194,12 +494,10 @@ def addblur2(clip, amount, blksize):
 
 	overlap = int(blksize/2)
 
-	sup = core.mv.Super(clip, pel=2)
+	sup = mvsuper(clip, pel=2)
 
-	mvbw1 = core.mv.Analyse(sup, isb=True, delta=1, overlap=overlap,
-			blksize=blksize)
-	mvfw1 = core.mv.Analyse(sup, isb=False, delta=1, overlap=overlap,
-			blksize=blksize)
+	mvbw1 = mvanalyse(sup, isb=True, delta=1, overlap=overlap, blksize=blksize)
+	mvfw1 = mvanalyse(sup, isb=False, delta=1, overlap=overlap, blksize=blksize)
 	clip = core.mv.FlowBlur(clip, sup, mvbw1, mvfw1, blur=amount)
 
 	return clip
@@ -210,32 +508,13 @@ def addblur2(clip, amount, blksize):
 #----------
 # Requirements: MVTools or MVTools-Float
 
-def addblur2(clip, amount=50, blksizeX=32, blksizeY=32, recalc=3, overlap=2):
+def addblur2(clip, amount=50, blksizeX=32, blksizeY=32, recalc=3, overlap=2,
+		proxy=None):
 
 	# analyze
-	bsX = blksizeX
-	bsY = blksizeY
-	if bsX>2: olX = int(bsX/overlap)
-	else: olX = 0
-	if bsY>2: olY = int(bsY/overlap)
-	else: olY = 0
-	sup = core.mv.Super(clip)
-	mvbw1 = core.mv.Analyse(sup, isb=True, delta=1, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	mvfw1 = core.mv.Analyse(sup, isb=False, delta=1, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	# do recalculations
-	for r in range(0, recalc):
-		bsX = bsX>>1
-		if bsX<4: break
-		bsY = bsY>>1
-		if bsY<4: break
-		olX = int(bsX/overlap)
-		olY = int(bsY/overlap)
-		mvbw1 = core.mv.Recalculate(sup, mvbw1, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
-		mvfw1 = core.mv.Recalculate(sup, mvfw1, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
+	sup = mvsuper(clip)
+	mvbw1, mvfw1 = mvvectorset(sup, 1, blksizeX, blksizeY, overlap, recalc,
+			proxy)
 
 	# process
 	clip = core.mv.FlowBlur(clip, sup, mvbw1, mvfw1, blur=amount)
@@ -256,15 +535,15 @@ def srmdsharpen(clip, amount=.25, noise_level=3, range=1):
 	orig_height = clip.height
 	new_width = int(clip.width/(1+amount)+.5)
 	new_height = int(clip.height/(1+amount)+.5)
-	clip = core.resize.Spline36(clip, format=vs.RGBS, matrix_in_s="709",
-			range=range, width=new_width, height=new_height)
+	clip = _torgbs(clip, core.resize.Spline36, range=range, width=new_width,
+			height=new_height)
 
 	# Upscale
 	clip = core.srmdnv.SRMD(clip, scale=2, noise=noise_level)
 
 	# Back to original size
-	clip = core.resize.Spline36(clip, format=orig_format, matrix_s="709",
-			width=orig_width, height=orig_height)
+	clip = _fromrgbs(clip, orig_format, core.resize.Spline36, width=orig_width,
+			height=orig_height)
 
 	return clip
 
@@ -290,7 +569,7 @@ def srmdsharpen(clip, amount=.25, noise_level=3, range=1):
 def neuralupscale(clip, method=0, model=1, noise=-1):
 
 	orig_format = clip.format
-	clip = core.resize.Bicubic(clip, format=vs.RGBS, matrix_in_s="709")
+	clip = _torgbs(clip)
 
 	if method==0:
 		clip = core.srmdnv.SRMD(clip, noise=noise)
@@ -299,7 +578,7 @@ def neuralupscale(clip, method=0, model=1, noise=-1):
 	elif method==2:
 		clip = core.rsnv.RealSR(clip, model=model)
 
-	clip = core.resize.Bicubic(clip, format=orig_format, matrix_s="709")
+	clip = _fromrgbs(clip, orig_format)
 	return clip
 
 
@@ -395,7 +674,7 @@ def rife(clip, model=73, factornum=2, factorden=1, fpsnum=60000, fpsden=1001,
 	src_fpsden = clip.fps_den
 	orig_fmt = clip.format
 	if orig_fmt!=vs.RGBS:
-			clip = core.resize.Bicubic(clip, format=vs.RGBS, matrix_in_s="709")
+			clip = _torgbs(clip)
 	if usefactor==True:
 		clip = core.rife.RIFE(clip, model=model, factor_num=factornum,
 				factor_den=factorden, uhd=uhd)
@@ -403,7 +682,7 @@ def rife(clip, model=73, factornum=2, factorden=1, fpsnum=60000, fpsden=1001,
 	  clip = core.rife.RIFE(clip, model=model, fps_num=fpsnum, fps_den=fpsden,
 	  		uhd=uhd)
 	if orig_fmt!=vs.RGBS:
-			clip = core.resize.Bicubic(clip, format=orig_fmt, matrix_s="709")
+			clip = _fromrgbs(clip, orig_fmt)
 	if keepfps==True:
 			clip = core.std.AssumeFPS(clip=clip, fpsnum=src_fpsnum, fpsden=src_fpsden)
 
@@ -426,9 +705,8 @@ def fixfieldjitter(clip, blksize=4, overlap=2, thsad=300, tff=True,
 	clip = core.znedi3.nnedi3(clip, field=nnf)
 
 	# Analyse
-	sup = core.mv.Super(clip, pel=2)
-	vec = core.mv.Analyse(sup, isb=False, delta=1, blksize=blksize,
-			overlap=overlap)
+	sup = mvsuper(clip, pel=2)
+	vec = mvanalyse(sup, isb=False, delta=1, blksize=blksize, overlap=overlap)
 
 	# Compensate
 	clip = core.mv.Compensate(clip=clip, super=sup, vectors=vec, thsad=thsad)
@@ -451,61 +729,47 @@ def fixfieldjitter(clip, blksize=4, overlap=2, thsad=300, tff=True,
 #----------------
 # RestoreDetails
 #----------------
+# The frame is replaced by the average of the 8 neighbouring frames (4 back, 4
+# forward) motion-compensated at 2x, all of them averaged by a single
+# AverageFrames call.
+# base_analysis: search the motion at the base resolution and scale the
+# vectors for the compensation at 2x (about 4 times less analysis work);
+# blksize is the block size at 2x either way. Needs mv.ScaleVect (MVTools
+# v24 or newer).
 # Requirements: MVTools or MVTools-Float
 
-def restoredetails(clip, blksize=8, thsad=200, skip_upscale=False):
+def restoredetails(clip, blksize=8, thsad=200, skip_upscale=False,
+		base_analysis=False):
 
 	# Upscale
+	base = clip
 	if skip_upscale==False:
 		clip = core.resize.Spline36(clip=clip, width=int(clip.width*2),
 			height=int(clip.height*2))
+	elif base_analysis:
+		base = core.resize.Spline36(clip=clip, width=clip.width//2,
+			height=clip.height//2)
+	sup = mvsuper(clip, pel=2)
 
 	# Analyze
-	overlap = int(blksize/2)
-	sup = core.mv.Super(clip, pel=2)
-	mvbw4 = core.mv.Analyse(sup, isb=True, delta=4, blksize=blksize,
-			overlap=overlap)
-	mvbw3 = core.mv.Analyse(sup, isb=True, delta=3, blksize=blksize,
-			overlap=overlap)
-	mvbw2 = core.mv.Analyse(sup, isb=True, delta=2, blksize=blksize,
-			overlap=overlap)
-	mvbw1 = core.mv.Analyse(sup, isb=True, delta=1, blksize=blksize,
-			overlap=overlap)
-	mvfw1 = core.mv.Analyse(sup, isb=False, delta=1, blksize=blksize,
-			overlap=overlap)
-	mvfw2 = core.mv.Analyse(sup, isb=False, delta=2, blksize=blksize,
-			overlap=overlap)
-	mvfw3 = core.mv.Analyse(sup, isb=False, delta=3, blksize=blksize,
-			overlap=overlap)
-	mvfw4 = core.mv.Analyse(sup, isb=False, delta=4, blksize=blksize,
-			overlap=overlap)
+	if base_analysis:
+		if not hasattr(core.mv, "ScaleVect"):
+			raise vs.Error("restoredetails: base_analysis needs mv.ScaleVect "
+					"(MVTools v24 or newer)")
+		bsup = mvsuper(base, pel=2)
+		bs = max(4, blksize//2)
+		vecs = [_mvcached("ScaleVect", [mvvectors(bsup, isb, delta, bs, bs, 2)],
+				{"scale": 2}) for isb in (True, False) for delta in (1, 2, 3, 4)]
+	else:
+		vecs = [mvvectors(sup, isb, delta, blksize, blksize, 2)
+				for isb in (True, False) for delta in (1, 2, 3, 4)]
 
 	# Compensate
-	mvcbw4 = core.mv.Compensate(clip=clip, super=sup, vectors=mvbw4,
-			thsad=thsad)
-	mvcbw3 = core.mv.Compensate(clip=clip, super=sup, vectors=mvbw3,
-			thsad=thsad)
-	mvcbw2 = core.mv.Compensate(clip=clip, super=sup, vectors=mvbw2,
-			thsad=thsad)
-	mvcbw1 = core.mv.Compensate(clip=clip, super=sup, vectors=mvbw1,
-			thsad=thsad)
-	mvcfw1 = core.mv.Compensate(clip=clip, super=sup, vectors=mvfw1,
-			thsad=thsad)
-	mvcfw2 = core.mv.Compensate(clip=clip, super=sup, vectors=mvfw2,
-			thsad=thsad)
-	mvcfw3 = core.mv.Compensate(clip=clip, super=sup, vectors=mvfw3,
-			thsad=thsad)
-	mvcfw4 = core.mv.Compensate(clip=clip, super=sup, vectors=mvfw4,
-			thsad=thsad)
+	comp = [core.mv.Compensate(clip=clip, super=sup, vectors=vec, thsad=thsad)
+			for vec in vecs]
 
 	# Merge frames
-	mrg1 = core.std.Merge(mvcbw4, mvcbw3, 0.5)
-	mrg2 = core.std.Merge(mvcbw2, mvcbw1, 0.5)
-	mrg3 = core.std.Merge(mvcfw1, mvcfw2, 0.5)
-	mrg4 = core.std.Merge(mvcfw3, mvcfw4, 0.5)
-	mrgf1 = core.std.Merge(mrg1, mrg2, 0.5)
-	mrgf2 = core.std.Merge(mrg3, mrg4, 0.5)
-	clip = core.std.Merge(mrgf1, mrgf2, 0.5)
+	clip = core.std.AverageFrames(comp, weights=[1]*len(comp))
 
 	return clip
 
@@ -590,18 +854,114 @@ def frameblur(clip, transition):
 	return clip
 
 
+#----------
+# Geometry
+#----------
+# Lens distortion, per-plane scaling and a centered zoom (crop and rescale)
+# combined into one map of source coordinates and applied in a single
+# resampling pass (Catmull-Rom bicubic, 4x4 taps) with akarin.Expr, instead of
+# a chain of resizes with a full-size frame and an interpolation at every step.
+# The maps depend only on the geometry, so they are rendered once and the same
+# frames are served for the whole clip (and for every clip of the same size
+# and format) until mvclear().
+# The output differs slightly from the resizer chains (bicubic instead of
+# Spline36), so debarrel and deaberration use it only with single_pass=True.
+# The lens model is the one of PanoTools and vcmove.DeBarrel: a point at the
+# distance r from the center (1 = half of the shorter side) is taken from
+# r*(a*r^3+b*r^2+c*r+d), d = 1-a-b-c.
+# Requirements: akarin
+
+_remaps = {}
+
+# Source coordinates of the pixels of every plane, 2 float frames (x, y)
+# zooms: zoom of every plane (>1 enlarges)
+def _remapmaps(clip, a, b, c, zooms):
+
+	fmt = clip.format
+	key = (fmt.id, clip.width, clip.height, a, b, c, tuple(zooms))
+	if key in _remaps:
+		return _remaps[key]
+
+	mfmt = core.query_video_format(fmt.color_family, vs.FLOAT, 32,
+			fmt.subsampling_w, fmt.subsampling_h)
+	blank = core.std.BlankClip(clip, format=mfmt.id, length=1)
+	w = clip.width
+	h = clip.height
+	norm = min(w, h)/2
+	d = 1-a-b-c
+	exprs = ([], [])
+	for p in range(fmt.num_planes):
+		sw = 1<<fmt.subsampling_w if p and fmt.color_family==vs.YUV else 1
+		sh = 1<<fmt.subsampling_h if p and fmt.color_family==vs.YUV else 1
+		# centered luma coordinates of the output pixel, zoomed
+		pos = ("X 0.5 + %d * %f - %f / px! Y 0.5 + %d * %f - %f / py! " %
+				(sw, w/2, zooms[p], sh, h/2, zooms[p]))
+		# lens
+		pos += ("px@ dup * py@ dup * + sqrt %f / r! "
+				"r@ %f * %f + r@ * %f + r@ * %f + f! " % (norm, a, b, c, d))
+		exprs[0].append(pos+"px@ f@ * %f + %d / 0.5 -" % (w/2, sw))
+		exprs[1].append(pos+"py@ f@ * %f + %d / 0.5 -" % (h/2, sh))
+	# rendered now, the frames are served for every clip of this geometry
+	maps = tuple(core.akarin.Expr(blank, e).get_frame(0) for e in exprs)
+	_remaps[key] = maps
+
+	return maps
+
+# Catmull-Rom weight of the tap k (-1..2) for the fraction t (variable name)
+def _cubicweight(k, t):
+
+	return {
+		-1: "%s@ dup dup * * -1 * %s@ dup * 2 * + %s@ - 0.5 *" % (t, t, t),
+		0: "%s@ dup dup * * 3 * %s@ dup * 5 * - 2 + 0.5 *" % (t, t),
+		1: "%s@ dup dup * * -3 * %s@ dup * 4 * + %s@ + 0.5 *" % (t, t, t),
+		2: "%s@ dup dup * * %s@ dup * - 0.5 *" % (t, t)}[k]
+
+def remap(clip, a=0.0, b=0.0, c=0.0, zoom=1.0, planezooms=None):
+
+	if not hasattr(core, "akarin"):
+		raise vs.Error("remap: needs the akarin plugin (akarin.Expr), also with "
+				"single_pass=True in debarrel and deaberration")
+	num = clip.num_frames
+	zooms = [zoom*(planezooms[p] if planezooms else 1)
+			for p in range(clip.format.num_planes)]
+	maps = _remapmaps(clip, a, b, c, zooms)
+	base = core.std.BlankClip(clip, format=maps[0].format.id, length=num,
+			keep=True)
+	mapx = core.std.ModifyFrame(base, base, lambda n, f: maps[0])
+	mapy = core.std.ModifyFrame(base, base, lambda n, f: maps[1])
+
+	# bicubic sampling of the source at the coordinates of the maps
+	expr = "y floor ix! z floor iy! y ix@ - fx! z iy@ - fy! "
+	for j in range(-1, 3):
+		for i in range(-1, 3):
+			expr += "ix@ %d + iy@ %d + x[] %s * " % (i, j, _cubicweight(i, "fx"))
+			if i>-1: expr += "+ "
+		expr += _cubicweight(j, "fy")+" * "
+		if j>-1: expr += "+ "
+
+	return core.akarin.Expr([clip, mapx, mapy], expr)
+
+
 #----------
 # Debarrel
 #----------
-# Requirements: vcmove
+# Lens correction for the Canon HF100 with Raynox x0.3 on with the 37mm-37mm
+# ring, the border leftovers are cropped (crop_height rows are kept) and the
+# picture is scaled back to the original size. single_pass: all of it in a
+# single resampling pass (see remap), faster and with one interpolation
+# instead of two, but not the same output as the default.
+# Requirements: vcmove (single_pass: akarin)
 
-def debarrel(clip):
+def debarrel(clip, a=0.005, b=0.009, c=0.085, crop_height=1073,
+		single_pass=False):
 
-	# Canon HF100 with Raynox x0.3 on with the 37mm-37mm ring
-	clip = core.vcmove.DeBarrel(clip=clip, a=0.005, b=0.009, c=0.085)
+	if single_pass:
+		return remap(clip, a, b, c, zoom=clip.height/crop_height)
+
+	clip = core.vcmove.DeBarrel(clip=clip, a=a, b=b, c=c)
 
 	# Crop debarrel border leftovers
-	new_height = 1073	# just as much as needed
+	new_height = crop_height	# just as much as needed
 	old_width = clip.width
 	old_height = clip.height
 	aspect = old_width/old_height
@@ -622,14 +982,14 @@ def debarrel(clip):
 
 # Requirements: MVTools or MVTools-Float, Deblock
 
-def decanon(clip, ml=40, quant=40, skip_decomb=False):
+def decanon(clip, ml=40, quant=40, skip_decomb=False, blksize=8):
 
 	overlap = 2
 
 	if skip_decomb==False:
 	    clip = core.vinverse.Vinverse(clip=clip)
-	sup = core.mv.Super(clip)
-	mvfw = core.mv.Analyse(sup, isb=False, overlap=overlap)
+	sup = mvsuper(clip)
+	mvfw = mvanalyse(sup, isb=False, overlap=overlap, blksize=blksize)
 	mask = core.mv.Mask(clip=clip, vectors=mvfw, kind=1, ml=ml, gamma=2.0)
 	deblock = core.deblock.Deblock(clip=clip, quant=quant)
 	clip = core.std.MaskedMerge(clip, deblock, mask)
@@ -659,9 +1019,8 @@ def deblock(clip, qp=8.0, mode=0, method=0, blksize=8, ml=16.0,
 	# Create mask
 	if method==0:
 		# MVTools Mask
-		overlap = int(blksize/2)
-		sup = core.mv.Super(clip)
-		mvfw = core.mv.Analyse(sup, isb=False, blksize=blksize, overlap=overlap)
+		sup = mvsuper(clip)
+		mvfw = mvvectors(sup, False, 1, blksize, blksize, 2)
 		mask = core.mv.Mask(clip=clip, vectors=mvfw, kind=1, ml=ml, gamma=1.0,
 				thscd1=thscd1, thscd2=thscd2)
 	elif method==1:
@@ -701,50 +1060,58 @@ def deblock(clip, qp=8.0, mode=0, method=0, blksize=8, ml=16.0,
 # For Canon HF100 with Raynox x0.3 with the 37mm-37mm ring:
 # r_size=1.002, g_size=1.002, b_size=1.000
 
-# Requirements: none
+# single_pass: all the planes in a single resampling pass (see remap)
 
-def deaberration(clip, r_size=1.000, g_size=1.002, b_size=1.004):
+# Requirements: none (single_pass: akarin)
+
+def deaberration(clip, r_size=1.000, g_size=1.002, b_size=1.004,
+		single_pass=False):
 
 	# Convert to RGB
 	orig_fmt = clip.format
 	if orig_fmt != vs.RGBS:
-		clip = core.resize.Bicubic(clip, format=vs.RGBS, matrix_in_s="709")
-
-	# Extract planes
-	r = core.std.ShufflePlanes(clips=clip, planes=0, colorfamily=vs.GRAY)
-	g = core.std.ShufflePlanes(clips=clip, planes=1, colorfamily=vs.GRAY)
-	b = core.std.ShufflePlanes(clips=clip, planes=2, colorfamily=vs.GRAY)
-
-	# Enlarge certain planes
-	if r_size > 1:
-		new_width = int(clip.width*r_size+.5)
-		new_height = int(clip.height*r_size+.5)
-		r = core.resize.Spline36(clip=r, width=new_width, height=new_height)
-		r = core.std.CropAbs(clip=r, width=clip.width, height=clip.height,
-				left=int((new_width-clip.width)/2+.5),
-				top=int((new_height-clip.height)/2+.5))
-	if g_size > 1:
-		new_width = int(clip.width*g_size+.5)
-		new_height = int(clip.height*g_size+.5)
-		g = core.resize.Spline36(clip=g, width=new_width, height=new_height)
-		g = core.std.CropAbs(clip=g, width=clip.width, height=clip.height,
-				left=int((new_width-clip.width)/2+.5),
-				top=int((new_height-clip.height)/2+.5))
-	if b_size > 1:
-		new_width = int(clip.width*b_size+.5)
-		new_height = int(clip.height*b_size+.5)
-		b = core.resize.Spline36(clip=b, width=new_width, height=new_height)
-		b = core.std.CropAbs(clip=b, width=clip.width, height=clip.height,
-				left=int((new_width-clip.width)/2+.5),
-				top=int((new_height-clip.height)/2+.5))
-
-	# Combine planes
-	clip = core.std.ShufflePlanes(clips=[r,g,b], planes=[0,0,0],
-			colorfamily=vs.RGB)
+		clip = _torgbs(clip)
+
+	if single_pass:
+		# The planes are enlarged in the same remap
+		clip = remap(clip, planezooms=[max(size, 1)
+				for size in (r_size, g_size, b_size)])
+	else:
+		# Extract planes
+		r = core.std.ShufflePlanes(clips=clip, planes=0, colorfamily=vs.GRAY)
+		g = core.std.ShufflePlanes(clips=clip, planes=1, colorfamily=vs.GRAY)
+		b = core.std.ShufflePlanes(clips=clip, planes=2, colorfamily=vs.GRAY)
+
+		# Enlarge certain planes
+		if r_size > 1:
+			new_width = int(clip.width*r_size+.5)
+			new_height = int(clip.height*r_size+.5)
+			r = core.resize.Spline36(clip=r, width=new_width, height=new_height)
+			r = core.std.CropAbs(clip=r, width=clip.width, height=clip.height,
+					left=int((new_width-clip.width)/2+.5),
+					top=int((new_height-clip.height)/2+.5))
+		if g_size > 1:
+			new_width = int(clip.width*g_size+.5)
+			new_height = int(clip.height*g_size+.5)
+			g = core.resize.Spline36(clip=g, width=new_width, height=new_height)
+			g = core.std.CropAbs(clip=g, width=clip.width, height=clip.height,
+					left=int((new_width-clip.width)/2+.5),
+					top=int((new_height-clip.height)/2+.5))
+		if b_size > 1:
+			new_width = int(clip.width*b_size+.5)
+			new_height = int(clip.height*b_size+.5)
+			b = core.resize.Spline36(clip=b, width=new_width, height=new_height)
+			b = core.std.CropAbs(clip=b, width=clip.width, height=clip.height,
+					left=int((new_width-clip.width)/2+.5),
+					top=int((new_height-clip.height)/2+.5))
+
+		# Combine planes
+		clip = core.std.ShufflePlanes(clips=[r,g,b], planes=[0,0,0],
+				colorfamily=vs.RGB)
 
 	# Convert back
 	if orig_fmt != vs.RGBS:
-		clip = core.resize.Bicubic(clip, format=orig_fmt, matrix_s="709")
+		clip = _fromrgbs(clip, orig_fmt)
 
 	return clip
 
@@ -870,7 +1237,7 @@ def denoise2(clip, blksizeX=8, blksizeY=8, overlap=2, thsad=300, thsadc=300,
 
 	if show_mask==True: return mask
 
-	sup = core.mv.Super(clip)
+	sup = mvsuper(clip)
 	normal = denoise(clip, blksizeX, blksizeY, overlap, thsad, thsadc,
 		ext_super=sup)
 	edges = denoise(clip, blksizeX, blksizeY, overlap, edges_thsad,
@@ -889,6 +1256,7 @@ def denoise2(clip, blksizeX=8, blksizeY=8, overlap=2, thsad=300, thsadc=300,
 #   improve quality (supported block sizes: 4x4, 8x4, 8x8, 16x2, 16x8, 16x16,
 #   32x16, 32x32, 64x32, 64x64, 128x64, 128x128)
 # recalc: number of recalculations (>0; e.g. for blksize=32 3 means 16,8,4)
+# radius: temporal radius (1..3, frames on each side)
 # overlap: overlap size, also used for edges (block size div factor, e.g. for
 #   blksize=16 2 means 8)
 # thsad, thsadc: motion detection thresholds (luma, chroma)
@@ -955,7 +1323,10 @@ def denoise3(clip, blksizeX=32, blksizeY=32, recalc=3, overlap=2, thsad=300,
 			mov_overlap=2, mov_ml=20.0, mov_th=127, mov_softness=5,
 			mov_amount=1.0, mov_thscd1=500, mov_thscd2=200, mov_antialias=0,
 			mov_deblock_enable=False, mov_deblock_qp=8.0, mov_deblock_mode=0,
-			mov_showmask=False):
+			mov_showmask=False, proxy=None, radius=3):
+
+	if radius<1 or radius>3:
+		raise vs.Error("denoise3: radius must be 1..3")
 
 	# prepare some vars
 	if thsad==0: plane = 3
@@ -973,84 +1344,29 @@ def denoise3(clip, blksizeX=32, blksizeY=32, recalc=3, overlap=2, thsad=300,
 	if edges_showmask==True: return edgemask
 
 	# denoise picture
-	bsX = blksizeX
-	bsY = blksizeY
-	if bsX>2: olX = int(bsX/overlap)
-	else: olX = 0
-	if bsY>2: olY = int(bsY/overlap)
-	else: olY = 0
-	sup = core.mv.Super(clip)
-	mvbw1 = core.mv.Analyse(sup, isb=True, delta=1, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	mvfw1 = core.mv.Analyse(sup, isb=False, delta=1, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	mvbw2 = core.mv.Analyse(sup, isb=True, delta=2, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	mvfw2 = core.mv.Analyse(sup, isb=False, delta=2, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	mvbw3 = core.mv.Analyse(sup, isb=True, delta=3, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	mvfw3 = core.mv.Analyse(sup, isb=False, delta=3, overlap=olX,
-			overlapv=olY, blksize=bsX, blksizev=bsY)
-	# do recalculations
-	for r in range(0, recalc):
-		bsX = bsX>>1
-		if bsX<4: break
-		bsY = bsY>>1
-		if bsY<4: break
-		olX = int(bsX/overlap)
-		olY = int(bsY/overlap)
-		mvbw1 = core.mv.Recalculate(sup, mvbw1, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
-		mvfw1 = core.mv.Recalculate(sup, mvfw1, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
-		mvbw2 = core.mv.Recalculate(sup, mvbw2, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
-		mvfw2 = core.mv.Recalculate(sup, mvfw2, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
-		mvbw3 = core.mv.Recalculate(sup, mvbw3, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
-		mvfw3 = core.mv.Recalculate(sup, mvfw3, overlap=olX, overlapv=olY,
-				blksize=bsX, blksizev=bsY)
-	# process
-	normal = core.mv.Degrain3(clip, sup, mvbw1, mvfw1, mvbw2, mvfw2,
-			mvbw3, mvfw3, thsad=thsad, thsadc=thsadc, plane=plane)
+	sup = mvsuper(clip)
+	vecs = mvvectorset(sup, radius, blksizeX, blksizeY, overlap, recalc, proxy)
+	normal = _degrain(clip, sup, vecs, thsad=thsad, thsadc=thsadc, plane=plane)
 
 	# process edges
 	if edges_proc==True:
 		if edges_params[0]>0 and edges_params[1]>0:
 			# do new analysis
-			if edges_params[0]>2: eolX = int(edges_params[0]/overlap)
-			else: eolX = 0
-			if edges_params[1]>2: eolY = int(edges_params[1]/overlap)
-			else: eolY = 0
 			if edges_rotate==True:
 				eclip = core.std.Transpose(clip)
-				esup = core.mv.Super(eclip)
+				esup = mvsuper(eclip)
 			else:
 				eclip = clip
 				esup = sup
-			emvbw1 = core.mv.Analyse(esup, isb=True, delta=1, overlap=eolX,
-					overlapv=eolY, blksize=edges_params[0], blksizev=edges_params[1])
-			emvfw1 = core.mv.Analyse(esup, isb=False, delta=1, overlap=eolX,
-					overlapv=eolY, blksize=edges_params[0], blksizev=edges_params[1])
-			emvbw2 = core.mv.Analyse(esup, isb=True, delta=2, overlap=eolX,
-					overlapv=eolY, blksize=edges_params[0], blksizev=edges_params[1])
-			emvfw2 = core.mv.Analyse(esup, isb=False, delta=2, overlap=eolX,
-					overlapv=eolY, blksize=edges_params[0], blksizev=edges_params[1])
-			emvbw3 = core.mv.Analyse(esup, isb=True, delta=3, overlap=eolX,
-					overlapv=eolY, blksize=edges_params[0], blksizev=edges_params[1])
-			emvfw3 = core.mv.Analyse(esup, isb=False, delta=3, overlap=eolX,
-					overlapv=eolY, blksize=edges_params[0], blksizev=edges_params[1])
-			edges = core.mv.Degrain3(eclip, esup, emvbw1, emvfw1, emvbw2,
-					emvfw2, emvbw3, emvfw3, thsad=edges_params[2],
+			evecs = mvvectorset(esup, radius, edges_params[0], edges_params[1],
+					overlap)
+			edges = _degrain(eclip, esup, evecs, thsad=edges_params[2],
 					thsadc=edges_params[3], plane=plane)
 			if edges_rotate==True:
 				edges = core.std.Transpose(edges)
 		else:
 			# re-use analysis
-			edges = core.mv.Degrain3(clip, sup, mvbw1, mvfw1, mvbw2,
-					mvfw2, mvbw3, mvfw3, thsad=edges_params[2],
+			edges = _degrain(clip, sup, vecs, thsad=edges_params[2],
 					thsadc=edges_params[3], plane=plane)
 		# merge
 		clip = core.std.MaskedMerge(normal, edges, edgemask)
@@ -1060,10 +1376,8 @@ def denoise3(clip, blksizeX=32, blksizeY=32, recalc=3, overlap=2, thsad=300,
 	# process motion areas
 	if mov_proc==True or mov_deblock_enable==True or mov_antialias>0:
 		# analyse
-		ol = int(mov_blksize/mov_overlap)
-		sup = core.mv.Super(clip)
-		mvfw = core.mv.Analyse(sup, isb=False, delta=1, overlap=ol,
-				blksize=mov_blksize)
+		sup = mvsuper(clip)
+		mvfw = mvvectors(sup, False, 1, mov_blksize, mov_blksize, mov_overlap)
 
 		# create motion mask
 		movmask = core.mv.Mask(clip=clip, vectors=mvfw, kind=1, ml=mov_ml,
@@ -1105,11 +1419,10 @@ def denoise3(clip, blksizeX=32, blksizeY=32, recalc=3, overlap=2, thsad=300,
 						vradius=radiusc)
 			elif mov_method==3:
 				# FlowBlur
-				olFB = int(mov_params[0]/mov_params[1])
-				mvfw = core.mv.Analyse(sup, isb=False, delta=1, overlap=olFB,
-					blksize=mov_params[0])
-				mvbw = core.mv.Analyse(sup, isb=True, delta=1, overlap=olFB,
-					blksize=mov_params[0])
+				mvfw = mvvectors(sup, False, 1, mov_params[0], mov_params[0],
+						mov_params[1])
+				mvbw = mvvectors(sup, True, 1, mov_params[0], mov_params[0],
+						mov_params[1])
 				mov = core.mv.FlowBlur(pre, sup, mvbw, mvfw, blur=mov_params[2])
 			elif mov_method==4:
 				# neo_fft3d
@@ -1267,45 +1580,207 @@ def asharpen(clip, t=1.0, d=0.0, b=-1.0, hqbf=False, edges_thr=127,
 
 #--------
 # MDeDup
+# pattern: "+" keeps a frame, "-" deletes it; for sources whose cadence
+#          changes it can be a list of segments [(start_frame, pattern,
+#          offset), ...], each one lasting until the start of the next one
+#          (offset can be omitted)
 # offset: start the pattern with offset
 # intro: introductory pattern, it is useful if the duplication pattern is
 #        slightly broken at the beginning of the clip
+# patternfile: read the segments from a pattern file (e.g. produced by
+#        cadence.py) instead of pattern/offset
 #--------
 # Manual frame deduplication
+# The frames to delete are computed beforehand and deleted by a single node
 # Requirements: none
 
-def mdedup(clip, pattern="+++-", offset=0, intro=""):
-
-  plen = len(pattern)
-
-  fnum = 0
-  delnum = 0
-
-  if len(intro)>0:
-    # Decimate the intro part
-    for i in range(len(intro)):
-      if intro[i]=="-":
-        clip = core.std.DeleteFrames(clip, [fnum-delnum])
-        delnum += 1
-      fnum += 1
-
-  if offset>0:
-    # Decimate the incomplete first cycle
-    for i in range(offset, plen):
-      if pattern[i]=="-":
-        clip = core.std.DeleteFrames(clip, [fnum-delnum])
-        delnum += 1
-      fnum += 1
-
-  # Continue with the full cycles
-  while fnum<clip.num_frames:
-    for i in range(plen):
-      if fnum>=clip.num_frames:
-        break
-      if pattern[i]=="-":
-        clip = core.std.DeleteFrames(clip, [fnum-delnum])
-        delnum += 1
-      fnum += 1
+def mdedup(clip, pattern="+++-", offset=0, intro="", patternfile=None):
+
+  if patternfile!=None:
+    segments = readpattern(patternfile)
+  elif isinstance(pattern, str):
+    segments = [(len(intro), pattern, offset)]
+  else:
+    segments = sorted(tuple(seg) for seg in pattern)
+
+  # Decimate the intro part
+  frames = [i for i in range(min(len(intro), clip.num_frames))
+      if intro[i]=="-"]
+
+  # Decimate the segments
+  for i, seg in enumerate(segments):
+    segstart = seg[0]
+    segpattern = seg[1]
+    segoffset = seg[2] if len(seg)>2 else 0
+    if i+1<len(segments):
+      segend = min(segments[i+1][0], clip.num_frames)
+    else:
+      segend = clip.num_frames
+    segstart_clip = max(segstart, len(intro))
+    plen = len(segpattern)
+    for phase in range(plen):
+      if segpattern[phase]=="-":
+        # first frame of this phase (the pattern starts with offset)
+        first = segstart+(phase-segoffset)%plen
+        if first<segstart_clip:
+          first += (segstart_clip-first+plen-1)//plen*plen
+        frames.extend(range(first, segend, plen))
+
+  if len(frames)==0:
+    return clip
+  clip = core.std.DeleteFrames(clip, sorted(set(frames)))
 
   return clip
 
+# Pattern file: one segment per line, "start_frame pattern offset"; empty lines
+# and lines starting with # are ignored
+
+def readpattern(path):
+
+  segments = []
+  with open(path) as pf:
+    for line in pf:
+      line = line.split("#")[0].split()
+      if len(line)==0:
+        continue
+      segments.append((int(line[0]), line[1],
+          int(line[2]) if len(line)>2 else 0))
+
+  return segments
+
+
+#------
+# Tier
+#------
+# Speed/quality tier of all the functions: "final" (the defaults of the
+# functions, for the final renders), "normal" or "draft" (cheaper motion
+# search and smaller temporal radius, for previews and test encodes). The
+# tier only changes the parameters not given in a call, so anything set
+# explicitly in a script stays as it is. Set it at the beginning of a script
+# or with the FPVS_TIER environment variable (file_proc_vs.sh -T), or for a
+# single call with tier=:
+#   f.tier("draft")
+#   clip = f.denoise3(clip, tier="final")
+# The functions not in the table below have no motion search or temporal
+# radius to trade for speed (range conversion, sharpening, dehalo, neural
+# models whose cost is set by the model...) and are the same in every tier.
+# Requirements: none
+
+_tiernames = ("draft", "normal", "final")
+
+def _checktier(name, where):
+
+	if name not in _tiernames:
+		raise vs.Error("%s: unknown tier %s (draft, normal or final)" % (where,
+				name))
+
+_tier = os.environ.get("FPVS_TIER") or "final"
+_checktier(_tier, "FPVS_TIER")
+_tiers = {
+	"denoise": {
+		"normal": {"radius": 2},
+		"draft": {"blksizeX": 16, "blksizeY": 16, "radius": 1}},
+	"denoise2": {
+		"draft": {"blksizeX": 16, "blksizeY": 16}},
+	"denoise3": {
+		"normal": {"recalc": 2, "radius": 2},
+		"draft": {"recalc": 1, "radius": 1}},
+	"flowfps": {
+		"normal": {"pel": 1},
+		"draft": {"blksize": 16, "pel": 1}},
+	"flowfps2": {
+		"normal": {"recalc": 2},
+		"draft": {"recalc": 1}},
+	"addblur2": {
+		"normal": {"recalc": 2},
+		"draft": {"recalc": 1}},
+	"fixfieldjitter": {
+		"draft": {"blksize": 8}},
+	"restoredetails": {
+		"draft": {"blksize": 16}},
+	"decanon": {
+		"draft": {"blksize": 16}},
+	"deblock": {
+		"draft": {"blksize": 16}},
+}
+
+def tier(name):
+
+	global _tier
+	_checktier(name, "tier")
+	_tier = name
+
+# Wrap a function so that the parameters not given in a call are set by the
+# tier
+def _tiered(func, settings):
+
+	import inspect
+	params = list(inspect.signature(func).parameters)
+
+	@functools.wraps(func)
+	def wrapper(*args, tier=None, **kwargs):
+		global _tier
+		if tier!=None: _checktier(tier, func.__name__)
+		for k, v in settings.get(tier or _tier, {}).items():
+			if k not in kwargs and params.index(k)>=len(args):
+				kwargs[k] = v
+		if tier==None:
+			return func(*args, **kwargs)
+		# the tiered functions called inside (e.g. denoise by denoise2) follow
+		# the tier of the call
+		outer = _tier
+		_tier = tier
+		try:
+			return func(*args, **kwargs)
+		finally:
+			_tier = outer
+
+	return wrapper
+
+for _name, _settings in _tiers.items():
+	globals()[_name] = _tiered(globals()[_name], _settings)
+
+
+#-----------
+# Profiling
+#-----------
+# Opt-in timing of the stages of a script (see profiler.py): every call of the
+# functions below becomes a stage, other filters can be marked as stages with
+# stage(), e.g.:
+#   f.profile("profile.txt", "profile.folded")
+#   clip = f.stage(core.vivtc.VFM(clip, order=0), "VFM")
+#   clip = f.fixfieldjitter(clip)
+# When not enabled stage() returns the clip as is and nothing is wrapped, so
+# the calls can be left in the scripts. Setting the FPVS_PROFILE environment
+# variable to a file name prefix enables profiling without editing the script
+# (<prefix>.txt and <prefix>.folded are written).
+# Requirements: none
+
+_profiler = None
+_profiled = ["tvrange", "fullrange", "ivtc", "denoise", "flowfps", "flowfps2",
+    "addblur2", "srmdsharpen", "neuralupscale", "rife", "fixfieldjitter",
+    "restoredetails", "slowdown", "speedup", "strobe", "frameblur", "debarrel",
+    "decanon", "deblock", "deaberration", "unsharpmask", "sharpen", "dehalo",
+    "denoise2", "denoise3", "lumachroma", "deghost", "asharpen", "mdedup"]
+
+def profile(report=None, folded=None):
+
+	global _profiler
+	if _profiler!=None:
+		return
+	import profiler
+	_profiler = profiler.Profiler(report, folded)
+	g = globals()
+	for name in _profiled:
+		g[name] = _profiler.wrap(g[name], name)
+
+def stage(clip, name):
+
+	if _profiler==None:
+		return clip
+
+	return _profiler.tap(clip, name)
+
+if os.environ.get("FPVS_PROFILE"):
+	profile(os.environ["FPVS_PROFILE"]+".txt",
+			os.environ["FPVS_PROFILE"]+".folded")
@@ -6,22 +6,41 @@ gmic_commands="banding_denoise_v2 50,0,20,30,0,0,0,133.257,16.7024"
 fps=23.976
 ffmpeg_options="-c:v libx264 -crf 16 -pix_fmt yuv420p"
 threads=8
+batch=4       # frames per gmic call
 in_dir="gmic_input_frames"
 out_dir="gmic_output_frames"
 gmic=gmic
+SDIR="$( cd "$( dirname "$0" )" >/dev/null 2>&1 && pwd )"
 
 # ctrlc
 ctrlc() {
-  echo "Abort"
+  echo "Abort, waiting for the running batches to finish..."
   abort=true
 }
 
+# Parse the named parameters
+while getopts "?s" opt; do
+  case "$opt" in
+    s) stream=true
+       ;;
+  esac
+done
+shift $((OPTIND - 1))
+
 # Help
 if [ $# -lt 2 ]; then
-  echo "Usage: gmic_proc.sh <input_video_file> <output_video_file>"
+  echo "Usage: gmic_proc.sh [-s] <input_video_file> <output_video_file>"
+  echo "  -s  stream the frames from the decoder through gmic to the encoder"
+  echo "      (gmic_stream.py) instead of using frame files"
   exit
 fi
 
+# Streaming mode: no frame files, the frame rate of the source is kept
+if [ $stream ]; then
+  exec python3 "$SDIR/gmic_stream.py" --commands="$gmic_commands" -j $threads \
+    -b $batch --options="$ffmpeg_options" -g $gmic "$1" "$2"
+fi
+
 # Extract video to images
 if [ ! -d "$in_dir" ]; then
   mkdir "$in_dir"
@@ -56,35 +75,84 @@ else
 fi
 
 # Main multi-threaded processing
+# Every free worker slot is a line in the pool FIFO; a worker processes a batch
+# of frames with a single gmic call, writes them under temporary names and
+# renames them when done, so that only finished frames are in the output dir
 echo "Processing..."
+pool_dir=$(mktemp -d)
+mkfifo "$pool_dir/slots"
+exec 3<>"$pool_dir/slots"
+i=0
+while [ $i -lt $threads ]; do
+  echo >&3
+  i=$(( i + 1 ))
+done
 trap "ctrlc" INT
-files=$(find "$in_dir" -maxdepth 1 -type f -iname "*.png" | sort -n -f)
-while [ -n "$files" ]; do
-  # Get free thread count
-  thr_working=$(pgrep -x $gmic | wc -l)
-  if [ $abort ] && [ ! $thr_working ]; then break; fi
-  thr_free=$(expr $threads - $thr_working)
-  # Run new threads
-  while [ $thr_free -gt 0 ] && [ -n "$files" ]; do
-    f=$(echo "$files" | head -n 1)
-    of="$out_dir"/$(basename "$f")
-    if [ -f "$of" ]; then
-      echo "Output file $of already exists. Skipping..."
-      files=$(echo "$files" | tail -n +2)
-      continue
-    fi
-    $gmic "$f" $gmic_commands -o "$of" &
-    if [ $? -ne 0 ]; then
-      exit
+
+# Run a worker for the frames in $batch_in
+run_batch() {
+  (
+    # Let the batch finish on Ctrl+C
+    trap '' INT
+    outs=
+    renames=
+    k=0
+    for f in $batch_in; do
+      of="$out_dir"/$(basename "$f")
+      tf="$out_dir"/.tmp_$(basename "$f")
+      outs="$outs -o[$k] $tf"
+      renames="$renames $tf:$of"
+      k=$(( k + 1 ))
+    done
+    if $gmic $batch_in $gmic_commands $outs < /dev/null; then
+      for r in $renames; do
+        mv "${r%%:*}" "${r#*:}"
+      done
+    else
+      touch "$pool_dir/failed"
+      for r in $renames; do
+        rm -f "${r%%:*}"
+      done
     fi
-    thr_free=$(expr $thr_free - 1)
-    files=$(echo "$files" | tail -n +2)
-  done
-  if [ $abort ]; then break; fi
-done
+    echo >&3
+  ) &
+}
+
+batch_in=
+batch_len=0
+while IFS= read -r f; do
+  if [ ! "$f" ]; then continue; fi
+  of="$out_dir"/$(basename "$f")
+  if [ -f "$of" ]; then
+    echo "Output file $of already exists. Skipping..."
+    continue
+  fi
+  batch_in="$batch_in $f"
+  batch_len=$(( batch_len + 1 ))
+  if [ $batch_len -lt $batch ]; then continue; fi
+  # Wait for a free slot (Ctrl+C interrupts the wait)
+  read -r token <&3
+  if [ $abort ] || [ -e "$pool_dir/failed" ]; then break; fi
+  run_batch
+  batch_in=
+  batch_len=0
+done << EOF
+$(find "$in_dir" -maxdepth 1 -type f -iname "*.png" | sort -n -f)
+EOF
+# The last incomplete batch
+if [ ! $abort ] && [ ! -e "$pool_dir/failed" ] && [ $batch_len -gt 0 ]; then
+  read -r token <&3
+  if [ ! $abort ]; then run_batch; fi
+fi
+# Wait for all the workers to finish (also when aborted)
+until wait; do true; done
 trap - INT
-# Wait for all threads to finish
-while pgrep -x $gmic > /dev/null; do true; done
+if [ -e "$pool_dir/failed" ]; then
+  echo "Processing failed"
+  abort=true
+fi
+rm -rf "$pool_dir"
+if [ $abort ]; then exit 1; fi
 
 # Encode
 echo "Encoding frames to video..."
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# GMIC_STREAM.PY
+# Streaming G'MIC processing of a video, without the frame files of
+# gmic_proc.sh
+#
+# The decoder (ffmpeg) writes raw RGB frames into a pipe, a pool of worker
+# threads runs G'MIC on batches of them and the results are written in the
+# original order into the pipe of the encoder (ffmpeg). Only the frames of the
+# batches in flight are on disk at any time, as uncompressed PPM files in a
+# RAM-backed directory (/dev/shm by default), because the gmic command line
+# tool can only exchange images through files.
+#
+# Usage: gmic_stream.py [options] <input_video_file> <output_video_file>
+# See gmic_stream.py -h for the options. gmic_proc.sh -s runs it with the
+# settings of gmic_proc.sh.
+#
+# Requirements: ffmpeg, G'MIC (command line)
+
+import argparse
+import collections
+import concurrent.futures
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import sourcecache
+
+gmic_commands = "banding_denoise_v2 50,0,20,30,0,0,0,133.257,16.7024"
+ffmpeg_options = "-c:v libx264 -crf 16 -pix_fmt yuv420p"
+
+# Read exactly size bytes from a pipe, less only at the end of the stream
+def _readexactly(pipe, size):
+
+	buf = bytearray()
+	while len(buf)<size:
+		chunk = pipe.read(size-len(buf))
+		if not chunk:
+			break
+		buf += chunk
+
+	return bytes(buf)
+
+def writeppm(path, width, height, data):
+
+	with open(path, "wb") as f:
+		f.write(b"P6\n%d %d\n255\n" % (width, height))
+		f.write(data)
+
+# Read an 8-bit PPM file, return (width, height, data)
+def readppm(path):
+
+	with open(path, "rb") as f:
+		raw = f.read()
+	# header: magic, width, height, maxval, separated by whitespace and comments
+	fields = []
+	pos = 0
+	while len(fields)<4:
+		while raw[pos:pos+1].isspace():
+			pos += 1
+		if raw[pos:pos+1]==b"#":
+			pos = raw.index(b"\n", pos)+1
+			continue
+		end = pos
+		while not raw[end:end+1].isspace():
+			end += 1
+		fields.append(raw[pos:end])
+		pos = end
+	if fields[0]!=b"P6" or fields[3]!=b"255":
+		raise ValueError("%s: not an 8-bit RGB PPM file (add 'cut 0,255' to "
+				"the G'MIC commands?)" % path)
+	width, height = int(fields[1]), int(fields[2])
+
+	return width, height, raw[pos+1:pos+1+width*height*3]
+
+# Process a batch of frames with a single gmic call
+def processbatch(gmic, commands, tmpdir, index, frames, width, height):
+
+	inputs = []
+	outputs = []
+	args = [gmic, "-v", "-1"]
+	for k, data in enumerate(frames):
+		name = os.path.join(tmpdir, "%08d" % (index+k))
+		writeppm(name+"_in.ppm", width, height, data)
+		inputs.append(name+"_in.ppm")
+		outputs.append(name+"_out.ppm")
+	args += inputs+shlex.split(commands)
+	for k, path in enumerate(outputs):
+		args += ["-o[%d]" % k, path]
+
+	try:
+		subprocess.run(args, stdin=subprocess.DEVNULL, check=True)
+		result = []
+		for path in outputs:
+			w, h, data = readppm(path)
+			if (w, h)!=(width, height):
+				raise ValueError("G'MIC changed the frame size to %dx%d" % (w, h))
+			result.append(data)
+	finally:
+		for path in inputs+outputs:
+			if os.path.exists(path):
+				os.remove(path)
+
+	return result
+
+# workers: number of gmic processes running at once
+# batch: frames per gmic call
+# audio: copy the audio of the source
+def process(src, dst, commands=gmic_commands, workers=None, batch=4,
+		options=ffmpeg_options, audio=False, tmpdir=None, gmic="gmic"):
+
+	if workers==None: workers = os.cpu_count() or 1
+	if tmpdir==None:
+		tmpdir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+	props = sourcecache.probe(src)
+	width, height = int(props["width"]), int(props["height"])
+	rate = props.get("avg_frame_rate", "0/0")
+	if rate.startswith("0"): rate = props["r_frame_rate"]
+	frame_size = width*height*3
+
+	decoder = subprocess.Popen(["ffmpeg", "-nostdin", "-hide_banner",
+			"-loglevel", "error", "-i", src, "-map", "0:v:0", "-f", "rawvideo",
+			"-pix_fmt", "rgb24", "pipe:"], stdout=subprocess.PIPE)
+	cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f",
+			"rawvideo", "-pix_fmt", "rgb24", "-s", "%dx%d" % (width, height), "-r",
+			rate, "-i", "pipe:"]
+	if audio:
+		cmd += ["-i", src, "-map", "0:v:0", "-map", "1:a?", "-c:a", "copy"]
+	cmd += shlex.split(options)+[dst]
+	encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+	workdir = tempfile.mkdtemp(prefix="gmic_stream_", dir=tmpdir)
+	pending = collections.deque()
+	window = workers*2
+	submitted = 0
+	count = 0
+	start = time.monotonic()
+	try:
+		with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+			eof = False
+			while not eof or pending:
+				if not eof:
+					frames = []
+					while len(frames)<batch:
+						data = _readexactly(decoder.stdout, frame_size)
+						if len(data)<frame_size:
+							eof = True
+							break
+						frames.append(data)
+					if frames:
+						pending.append(pool.submit(processbatch, gmic, commands,
+								workdir, submitted, frames, width, height))
+						submitted += len(frames)
+				# write the finished batches in order, wait for the oldest if the
+				# window is full
+				while pending and (eof or len(pending)>=window or
+						pending[0].done()):
+					for data in pending.popleft().result():
+						encoder.stdin.write(data)
+						count += 1
+					print("\rFrames: %d (%.2f fps)" % (count,
+							count/(time.monotonic()-start)), end="", file=sys.stderr)
+		print(file=sys.stderr)
+		encoder.stdin.close()
+	except BaseException:
+		for fut in pending:
+			fut.cancel()
+		decoder.kill()
+		encoder.kill()
+		raise
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	if decoder.wait()!=0:
+		raise RuntimeError("decoding failed")
+	if encoder.wait()!=0:
+		raise RuntimeError("encoding failed")
+
+	return count
+
+def main():
+
+	parser = argparse.ArgumentParser(
+			description="Process a video with G'MIC, streaming the frames from the "
+			"decoder to the encoder")
+	parser.add_argument("src_file", help="input video file")
+	parser.add_argument("dst_file", help="output video file")
+	parser.add_argument("-c", "--commands", default=gmic_commands,
+			help="G'MIC commands (default: %(default)s)")
+	parser.add_argument("-j", "--workers", type=int,
+			help="number of gmic processes running at once (default: number of "
+			"CPUs)")
+	parser.add_argument("-b", "--batch", type=int, default=4,
+			help="frames per gmic call (default: %(default)s)")
+	parser.add_argument("-o", "--options", default=ffmpeg_options,
+			help="ffmpeg encoding options (default: %(default)s)")
+	parser.add_argument("-a", "--audio", action="store_true",
+			help="copy the audio of the source")
+	parser.add_argument("-t", "--tmpdir", help="directory for the frames in "
+			"flight (default: /dev/shm)")
+	parser.add_argument("-g", "--gmic", default="gmic",
+			help="gmic executable (default: %(default)s)")
+	args = parser.parse_args()
+
+	try:
+		process(args.src_file, args.dst_file, args.commands, args.workers,
+				args.batch, args.options, args.audio, args.tmpdir, args.gmic)
+	except KeyboardInterrupt:
+		print("\nAbort", file=sys.stderr)
+		sys.exit(1)
+
+if __name__=="__main__":
+	main()
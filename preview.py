@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# PREVIEW.PY
+# Seekable preview of a VapourSynth script in mpv
+#
+# The output of the script is served over HTTP (on localhost) as a virtual
+# y4m file whose frames are rendered on demand, so the player can seek, pause
+# and rewind freely without restarting the script. The rendered frames are
+# kept in a bounded LRU cache (going back to a detail that was already shown
+# costs nothing) and the frames following the last one read are rendered
+# ahead. The extracted audio is played along with the same delay as in the
+# preview of file_proc_vs.sh.
+#
+# Usage: preview.py [options] <src_file> <proc.py>
+# See preview.py -h for the options. file_proc_vs.sh -p -s runs it with the
+# settings of file_proc_vs.sh.
+#
+# Requirements: VapourSynth, mpv
+
+import vapoursynth as vs
+from vapoursynth import core
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import re
+import subprocess
+import sys
+import threading
+
+import driver
+
+#------------
+# VirtualY4M
+#------------
+# y4m stream of a clip with random access by byte position
+
+class VirtualY4M:
+
+	# cachesize: maximum size of the cached frames in bytes
+	# prefetch: number of frames rendered ahead of the last one read
+	def __init__(self, clip, cachesize=1024<<20, prefetch=None):
+
+		if prefetch==None: prefetch = core.num_threads
+		self.clip = clip
+		self.cachesize = cachesize
+		self.prefetch = prefetch
+		f0 = clip.get_frame(0)
+		sar = (f0.props.get("_SARNum", 0), f0.props.get("_SARDen", 0))
+		self.header = driver.y4mheader(clip, sar).encode()
+		fmt = clip.format
+		self.framesize = len(b"FRAME\n")
+		for p in range(fmt.num_planes):
+			w = clip.width>>(fmt.subsampling_w if p else 0)
+			h = clip.height>>(fmt.subsampling_h if p else 0)
+			self.framesize += w*h*fmt.bytes_per_sample
+		self.size = len(self.header)+clip.num_frames*self.framesize
+		# reentrant: a frame already rendered calls back in the requesting thread
+		self.lock = threading.RLock()
+		self.cache = collections.OrderedDict()
+		self.cached = 0
+		self.pending = {}
+		self.hits = 0
+		self.misses = 0
+
+	def _tobytes(self, f):
+
+		return b"".join([b"FRAME\n"]+[memoryview(f[p]).tobytes()
+				for p in range(f.format.num_planes)])
+
+	# Start rendering a frame (lock held), return a future of its data
+	def _request(self, n):
+
+		if n in self.pending:
+			return self.pending[n]
+		out = concurrent.futures.Future()
+		self.pending[n] = out
+
+		def done(fut):
+			try:
+				data = self._tobytes(fut.result())
+			except Exception as e:
+				with self.lock:
+					del self.pending[n]
+				out.set_exception(e)
+				return
+			with self.lock:
+				del self.pending[n]
+				self.cache[n] = data
+				self.cached += len(data)
+				while self.cached>self.cachesize and len(self.cache)>1:
+					self.cached -= len(self.cache.popitem(last=False)[1])
+			out.set_result(data)
+
+		self.clip.get_frame_async(n).add_done_callback(done)
+
+		return out
+
+	# Data of a frame, the next frames are requested ahead
+	def frame(self, n):
+
+		with self.lock:
+			data = self.cache.get(n)
+			if data!=None:
+				self.cache.move_to_end(n)
+				self.hits += 1
+			else:
+				fut = self._request(n)
+				self.misses += 1
+			for k in range(n+1, min(n+1+self.prefetch, self.clip.num_frames)):
+				if k not in self.cache:
+					self._request(k)
+
+		return data if data!=None else fut.result()
+
+	# Data from a byte position up to the end of the header or frame there, at
+	# most size bytes
+	def read(self, pos, size):
+
+		hlen = len(self.header)
+		if pos<hlen:
+			return self.header[pos:min(hlen, pos+size)]
+		n, offset = divmod(pos-hlen, self.framesize)
+
+		return self.frame(n)[offset:offset+size]
+
+	def stats(self):
+
+		with self.lock:
+			total = self.hits+self.misses
+
+			return "Cache: %d frames (%d MB), %d%% hits" % (len(self.cache),
+					self.cached>>20, self.hits*100//total if total else 0)
+
+
+#--------
+# Server
+#--------
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, *args):
+
+		pass
+
+	def do_HEAD(self):
+
+		self.respond(False)
+
+	def do_GET(self):
+
+		self.respond(True)
+
+	def respond(self, body):
+
+		video = self.server.video
+		start, end = 0, video.size-1
+		m = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+		if m and (m.group(1) or m.group(2)):
+			if m.group(1):
+				start = int(m.group(1))
+				if m.group(2): end = min(int(m.group(2)), video.size-1)
+			else:
+				start = max(0, video.size-int(m.group(2)))
+			if start>=video.size:
+				self.send_response(416)
+				self.send_header("Content-Range", "bytes */%d" % video.size)
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+				return
+			self.send_response(206)
+			self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end,
+					video.size))
+		else:
+			self.send_response(200)
+		self.send_header("Content-Type", "video/x-yuv4mpeg")
+		self.send_header("Accept-Ranges", "bytes")
+		self.send_header("Content-Length", str(end-start+1))
+		self.end_headers()
+		if not body:
+			return
+
+		try:
+			pos = start
+			while pos<=end:
+				data = video.read(pos, end+1-pos)
+				self.wfile.write(data)
+				pos += len(data)
+		except (BrokenPipeError, ConnectionResetError):
+			# the player seeks by closing the connection
+			pass
+
+# Serve a clip on localhost, return the server (running in a thread) and the
+# URL of the stream
+# port: 0 = any free port
+def serve(clip, port=0, **args):
+
+	server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+	server.daemon_threads = True
+	server.video = VirtualY4M(clip, **args)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	return server, "http://127.0.0.1:%d/preview.y4m" % server.server_address[1]
+
+# Preview a script in mpv
+# audio: audio file played along, audio_start: its start time in seconds
+# cachesize: maximum size of the cached frames in MB
+def preview(src, script, start=0, end=None, threads=None, audio=None,
+		audio_start=0, pause=False, cachesize=1024, prefetch=None, port=0):
+
+	if threads: core.num_threads = threads
+	clip = driver.evalscript(script, src)
+	if end==None or end>=clip.num_frames: end = clip.num_frames-1
+	clip = clip[start:end+1]
+	server, url = serve(clip, port, cachesize=cachesize<<20, prefetch=prefetch)
+	print("Serving %s" % url, file=sys.stderr)
+
+	cmd = ["mpv", "--fs", "--cache=no"]
+	if pause: cmd.append("--pause")
+	if audio:
+		cmd += ["--audio-file=%s" % audio, "--audio-delay=%s" % -audio_start]
+	cmd.append(url)
+	player = subprocess.Popen(cmd)
+	try:
+		ret = player.wait()
+	except KeyboardInterrupt:
+		player.terminate()
+		ret = player.wait()
+	finally:
+		server.shutdown()
+		print(server.video.stats(), file=sys.stderr)
+
+	return ret
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Seekable preview of a "
+			"VapourSynth script in mpv, with the rendered frames cached")
+	parser.add_argument("src_file", help="source file")
+	parser.add_argument("script", help="VapourSynth script (gets the source as "
+			"'filename', like with file_proc_vs.sh)")
+	parser.add_argument("-s", "--start", type=int, default=0,
+			help="start frame (default: %(default)s)")
+	parser.add_argument("-e", "--end", type=int, help="end frame")
+	parser.add_argument("-t", "--threads", type=int, help="VapourSynth threads "
+			"(default: all)")
+	parser.add_argument("-c", "--cache", type=int, default=1024,
+			help="maximum size of the cached frames in MB (default: %(default)s)")
+	parser.add_argument("-r", "--prefetch", type=int, help="frames rendered "
+			"ahead (default: number of threads)")
+	parser.add_argument("-a", "--audio", help="audio file played along")
+	parser.add_argument("-d", "--audio-start", type=float, default=0,
+			help="audio start time in seconds (default: %(default)s)")
+	parser.add_argument("-x", "--pause", action="store_true",
+			help="start in the paused state")
+	parser.add_argument("-p", "--port", type=int, default=0,
+			help="HTTP port (default: any free port)")
+	args = parser.parse_args()
+
+	sys.exit(preview(args.src_file, args.script, args.start, args.end,
+			args.threads, args.audio, args.audio_start, args.pause, args.cache,
+			args.prefetch, args.port))
+
+if __name__=="__main__":
+	main()
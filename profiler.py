@@ -0,0 +1,181 @@
+# PROFILER.PY
+# Per-stage timing of VapourSynth scripts (used by functions.py)
+#
+# A stage is a clip produced by a functions.py call (or marked with
+# functions.stage). Its output is wrapped in two taps: a FrameEval that notes
+# when a frame is requested and a ModifyFrame that notes when it is ready, so
+# the latency of every frame of every stage is known. The own time of a stage
+# is its latency minus the latency of the stage it takes its input from. The
+# taps only pass the frames through (no copies), so the overhead is two Python
+# calls per frame per stage, small compared to any real filter.
+# The own times are approximate: a temporal filter waits for several frames of
+# its input, which are rendered in parallel and partly cached, so its latency
+# minus the input latency is only an estimate of its own work (the latencies
+# themselves are exact, also with the same frame requested concurrently).
+#
+# The report is a table of the stages sorted by their share of the render time
+# and/or a folded stacks file (stage;stage;stage microseconds), which can be
+# turned into a flame graph with flamegraph.pl or opened in speedscope. Both
+# are rewritten every few seconds and at exit.
+
+import vapoursynth as vs
+from vapoursynth import core
+import atexit
+import functools
+import sys
+import threading
+import time
+
+#-------
+# Stage
+#-------
+
+class _Stage:
+
+	def __init__(self, name, parent):
+
+		self.name = name
+		self.parent = parent
+		self.requested = {}
+		self.frames = 0
+		self.total = 0.0
+
+	def latency(self):
+
+		return self.total/self.frames if self.frames else 0.0
+
+	# Average time per frame spent in this stage itself
+	def own(self):
+
+		if self.parent==None:
+			return self.latency()
+
+		return max(0.0, self.latency()-self.parent.latency())
+
+	# Names from the first stage to this one
+	def path(self):
+
+		names = []
+		stage = self
+		while stage:
+			names.append(stage.name.replace(";", ",").replace(" ", "_"))
+			stage = stage.parent
+
+		return ";".join(reversed(names))
+
+
+#----------
+# Profiler
+#----------
+
+class Profiler:
+
+	# report: file name of the table (None = stderr at exit)
+	# folded: file name of the folded stacks
+	# interval: seconds between rewriting the files
+	def __init__(self, report=None, folded=None, interval=10):
+
+		self.report = report
+		self.folded = folded
+		self.interval = interval
+		self.stages = []
+		self.outputs = {}
+		self.last = None
+		self.lock = threading.Lock()
+		self.written = time.monotonic()
+		atexit.register(self.write)
+
+	# Stage whose output is the clip, or None
+	def stageof(self, clip):
+
+		entry = self.outputs.get(id(clip))
+
+		return entry[1] if entry else None
+
+	# Time the frames of a clip as a stage
+	# parent: the stage the clip is made from, by default the last one created
+	# (right for linear scripts)
+	def tap(self, clip, name, parent=False):
+
+		if parent==False: parent = self.last
+		stage = _Stage(name, parent)
+
+		# concurrent requests of the same frame are matched in order
+		def request(n):
+			t = time.perf_counter()
+			with self.lock:
+				stage.requested.setdefault(n, []).append(t)
+			return clip
+
+		def ready(n, f):
+			t = time.perf_counter()
+			with self.lock:
+				starts = stage.requested.get(n)
+				if starts:
+					t0 = starts.pop(0)
+					if not starts: del stage.requested[n]
+					stage.frames += 1
+					stage.total += t-t0
+			if self.report or self.folded:
+				if time.monotonic()-self.written>=self.interval:
+					self.written = time.monotonic()
+					self.write(False)
+			return f
+
+		out = core.std.FrameEval(clip, request)
+		out = core.std.ModifyFrame(out, out, ready)
+		with self.lock:
+			self.stages.append(stage)
+			# keep the clip referenced so that its id is not reused
+			self.outputs[id(out)] = (out, stage)
+			self.last = stage
+
+		return out
+
+	# Wrap a function returning a clip so that its output becomes a stage
+	def wrap(self, func, name):
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			out = func(*args, **kwargs)
+			# the clip may be passed by name
+			clip = args[0] if args else kwargs.get("clip")
+			if not isinstance(out, vs.VideoNode) or \
+					not isinstance(clip, vs.VideoNode):
+				return out
+			return self.tap(out, name, self.stageof(clip))
+
+		return wrapper
+
+	def table(self):
+
+		with self.lock:
+			stages = [s for s in self.stages if s.frames]
+		total = sum(s.own() for s in stages) or 1.0
+		lines = ["%-32s %8s %12s %12s %7s" % ("Stage", "Frames", "Latency ms",
+				"Own ms", "Share")]
+		for s in sorted(stages, key=lambda s: s.own(), reverse=True):
+			lines.append("%-32s %8d %12.2f %12.2f %6.1f%%" % (s.name[:32], s.frames,
+					s.latency()*1000, s.own()*1000, s.own()*100/total))
+
+		return "\n".join(lines)+"\n"
+
+	def stacks(self):
+
+		with self.lock:
+			stages = [s for s in self.stages if s.frames]
+		lines = ["%s %d" % (s.path(), int(s.own()*s.frames*1e6)) for s in stages]
+
+		return "\n".join(lines)+"\n"
+
+	# final: at exit, the table goes to stderr if there is no report file
+	def write(self, final=True):
+
+		if self.report:
+			with open(self.report, "w") as rf:
+				rf.write(self.table())
+		elif final and self.stages:
+			sys.stderr.write("\n"+self.table())
+		if self.folded:
+			with open(self.folded, "w") as ff:
+				ff.write(self.stacks())
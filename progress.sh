@@ -1,27 +1,149 @@
 #!/bin/sh
 # by Efenstor, 2022-2023
+# Revision 2026-10-18
 
+# User defines
+interval=1      # display update interval, seconds
+smoothing=20    # time constant of the speed averaging, seconds
+poll_interval=5 # minimum interval between recounts without inotifywait
+
+# Internal defines
+GREEN="\033[0;32m"
+YELLOW="\033[1;33m"
+NC="\033[0m"
 DELLINE="\r\033[0K"
 
+# Parse the named parameters
+ratio=1
+optstr="?r:m"
+while getopts $optstr opt; do
+  case "$opt" in
+    r) ratio=$OPTARG
+       ;;
+    m) machine=true
+       ;;
+    :) echo "Missing argument for -$OPTARG" >&2
+       exit 1
+       ;;
+  esac
+done
+shift $((OPTIND - 1))
+
 if [ $# -lt 2 ]; then
   printf "\n${YELLOW}Display progress when processing files by another process
 ${GREEN}(copyleft) Efenstor${NC}\n
-Usage: progress.sh <src_dir> <dst_dir>\n
+Usage: progress.sh [options] <src_dir> <dst_dir>\n
+Options:
+  -r num   number of output files per source file (default: 1)
+  -m       machine-readable output: a line per update with tab-separated
+           elapsed seconds, output files done, total, percent, files/s,
+           frames/s (source files/s) and ETA in seconds (-1 if unknown)
 Parameters:
   src_dir  directory containing source files
   dst_dir  directory where processed files are being placed
+
+The new files are counted from filesystem notifications if inotifywait
+(inotify-tools) is installed (hidden files, e.g. the temporary files of
+gmic_proc.sh, are not counted), otherwise the directory is only recounted when
+it has changed, at most every $poll_interval seconds.
 \n"
   exit
 fi
 
-ftotal=$(($(ls "$1" | wc -l)*2))
-fdone=0
-while [ $fdone -lt $ftotal ]
-do
-  fdone=$(ls "$2" | wc -l)
-  pdone=$(($fdone*100/$ftotal))
-  echo -n "Done: $pdone% ($fdone/$ftotal)"
-  sleep 1
-  echo -n $DELLINE
-done
+src_dir="$1"
+dst_dir="$2"
 
+# Monotonic time in seconds
+now() {
+  cut -d " " -f 1 /proc/uptime
+}
+
+# Events: a line with the name of every new file, an empty line every interval
+tmp_dir=$(mktemp -d)
+mkfifo "$tmp_dir/events"
+trap 'kill $pids 2>/dev/null; rm -rf "$tmp_dir"' EXIT
+trap 'exit 1' INT TERM
+pids=
+if command -v inotifywait > /dev/null; then
+  inotifywait -m -q -e close_write -e moved_to --format "%f" "$dst_dir" \
+    > "$tmp_dir/events" &
+  pids=$!
+else
+  poll=true
+fi
+while true; do echo; sleep $interval; done > "$tmp_dir/events" &
+pids="$pids $!"
+exec 3< "$tmp_dir/events"
+
+# The directories are listed only once (the files created in the meantime are
+# reported by the events)
+ftotal=$(( $(ls "$src_dir" | wc -l) * ratio ))
+fdone=$(ls "$dst_dir" | wc -l)
+start=$(now)
+last=$start
+last_done=$fdone
+dir_time=$(stat -c %.9Y "$dst_dir")
+count_time=$start
+speed=
+
+while read -r event <&3; do
+  if [ "$event" ]; then
+    # Hidden (temporary) files are skipped: a file written under a hidden name
+    # and renamed (like by gmic_proc.sh) is counted once, when it is renamed
+    case "$event" in
+      .*) continue
+          ;;
+    esac
+    fdone=$(( fdone + 1 ))
+    continue
+  fi
+  t=$(now)
+  if [ $poll ]; then
+    # Recount only if the directory has changed
+    d=$(stat -c %.9Y "$dst_dir")
+    if [ "$d" != "$dir_time" ] && \
+      [ "$(awk "BEGIN {print (($t)-($count_time) >= $poll_interval)}")" = 1 ]; then
+      fdone=$(ls "$dst_dir" | wc -l)
+      dir_time=$d
+      count_time=$t
+    fi
+  fi
+  if [ $fdone -gt $ftotal ]; then fdone=$ftotal; fi
+  # Exponential moving average of the speed
+  stats=$(awk -v t=$t -v last=$last -v n=$fdone -v last_n=$last_done \
+    -v speed="$speed" -v total=$ftotal -v start=$start -v tau=$smoothing \
+    'BEGIN {
+      dt = t - last
+      if (dt > 0) {
+        inst = (n - last_n) / dt
+        if (speed == "") speed = inst
+        else speed += (inst - speed) * (1 - exp(-dt / tau))
+      }
+      eta = (speed > 0) ? (total - n) / speed : -1
+      printf "%f %.1f %d %f", speed + 0, t - start, eta, total ? n * 100 / total : 100
+    }')
+  speed=${stats%% *}
+  stats=${stats#* }
+  elapsed=${stats%% *}
+  stats=${stats#* }
+  eta=${stats%% *}
+  pdone=${stats#* }
+  last=$t
+  last_done=$fdone
+  fps=$(awk "BEGIN {print ($speed)/($ratio)}")
+  if [ $machine ]; then
+    printf "%s\t%d\t%d\t%.1f\t%.2f\t%.2f\t%d\n" $elapsed $fdone $ftotal \
+      $pdone $speed $fps $eta
+  else
+    if [ $eta -ge 0 ]; then
+      eta_str=$(printf "%d:%02d:%02d" $(( eta / 3600 )) $(( eta / 60 % 60 )) \
+        $(( eta % 60 )))
+    else
+      eta_str="--:--:--"
+    fi
+    printf "${DELLINE}Done: %d%% (%d/%d), %.2f files/s, %.2f frames/s, ETA %s" \
+      ${pdone%.*} $fdone $ftotal $speed $fps "$eta_str"
+  fi
+  if [ $fdone -ge $ftotal ]; then break; fi
+done
+if [ ! $machine ]; then echo; fi
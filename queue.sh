@@ -0,0 +1,125 @@
+# Shared-directory work queue, sourced by batch_proc_vs.sh and file_proc_vs.sh
+# (copyleft) Efenstor 2015-2026
+#
+# Any number of workers on any number of hosts can drain the same set of work
+# items (source files or frame chunks) through a directory on a shared POSIX
+# filesystem (e.g. NAS):
+#   <queue_dir>/claims/<item>/  an item being processed; mkdir is atomic, so
+#                               only one worker can claim an item
+#   <queue_dir>/claims/<item>/heartbeat
+#                               touched every queue_heartbeat seconds by the
+#                               worker; a claim whose heartbeat is older than
+#                               queue_timeout seconds belongs to a crashed
+#                               worker and is taken over by another one
+#   <queue_dir>/claims/<item>.takeover/
+#                               held while a stale claim is being taken over
+#   <queue_dir>/done/<item>     an item that has been finished; the markers are
+#                               never removed, so the callers put a checksum of
+#                               the processing parameters (queue_key) in the
+#                               item names, and deleting <queue_dir>/done makes
+#                               the same work be done again
+
+queue_heartbeat=30
+queue_timeout=300
+# PID of the worker, identifies its claims and is checked by the heartbeat;
+# set it in background subshells (where $$ is the PID of the parent shell)
+queue_pid=
+
+# Convert an item name to a file name
+queue_id() {
+  echo "$1" | sed "s/[^A-Za-z0-9._-]/_/g"
+}
+
+# Checksum of the processing parameters (stdin), to be included in the items
+queue_key() {
+  cksum | cut -d " " -f 1
+}
+
+# $1 = queue dir
+queue_init() {
+  mkdir -p "$1/claims" "$1/done"
+}
+
+# $1 = queue dir, $2 = item
+queue_isdone() {
+  [ -e "$1/done/$(queue_id "$2")" ]
+}
+
+# Check if a claim (or a takeover lock) has not been heartbeating for
+# queue_timeout
+# $1 = claim dir
+queue_stale() {
+  q_beat="$1/heartbeat"
+  if [ ! -e "$q_beat" ]; then q_beat="$1"; fi
+  [ -e "$q_beat" ] && \
+    [ "$(find "$q_beat" -prune -mmin +$(( queue_timeout/60 )) 2>/dev/null)" ]
+}
+
+# Try to claim an item, returns 0 if it is ours now
+# $1 = queue dir, $2 = item
+queue_claim() {
+  q_claim="$1/claims/$(queue_id "$2")"
+  if queue_isdone "$1" "$2"; then return 1; fi
+  if ! mkdir "$q_claim" 2>/dev/null; then
+    # Take over the claim if its worker stopped heartbeating
+    if ! queue_stale "$q_claim"; then return 1; fi
+    # Only one worker at a time takes over (the lock of a worker crashed in
+    # the meantime expires like a claim)
+    q_lock="$q_claim.takeover"
+    if ! mkdir "$q_lock" 2>/dev/null; then
+      if queue_stale "$q_lock"; then rmdir "$q_lock" 2>/dev/null; fi
+      return 1
+    fi
+    # Check again, the claim may have just been taken over by another worker
+    if [ -d "$q_claim" ] && ! queue_stale "$q_claim"; then
+      rmdir "$q_lock"
+      return 1
+    fi
+    echo "Taking over the abandoned claim of \"$2\""
+    rm -rf "$q_claim"
+    if ! mkdir "$q_claim" 2>/dev/null; then
+      rmdir "$q_lock"
+      return 1
+    fi
+    rmdir "$q_lock"
+  fi
+  q_pid=${queue_pid:-$$}
+  q_owner="$(hostname) $q_pid"
+  echo "$q_owner" > "$q_claim/owner"
+  touch "$q_claim/heartbeat"
+  # Keep the claim alive while the worker is running and it is still ours
+  (
+    while kill -0 $q_pid 2>/dev/null && \
+      [ "$(cat "$q_claim/owner" 2>/dev/null)" = "$q_owner" ]; do
+      touch "$q_claim/heartbeat" 2>/dev/null
+      sleep $queue_heartbeat
+    done
+  ) &
+  q_heartbeat_pid=$!
+  return 0
+}
+
+# Stop heartbeating and mark the claimed item as done
+# $1 = queue dir, $2 = item
+queue_done() {
+  kill $q_heartbeat_pid 2>/dev/null
+  touch "$1/done/$(queue_id "$2")"
+  queue_unclaim "$1" "$2"
+}
+
+# Stop heartbeating and give the claimed item back (e.g. cancelled)
+# $1 = queue dir, $2 = item
+queue_release() {
+  kill $q_heartbeat_pid 2>/dev/null
+  queue_unclaim "$1" "$2"
+}
+
+# Remove the claim of an item unless it has been taken over by another worker
+# $1 = queue dir, $2 = item
+queue_unclaim() {
+  q_claim="$1/claims/$(queue_id "$2")"
+  if [ "$(cat "$q_claim/owner" 2>/dev/null)" = "$(hostname) ${queue_pid:-$$}" ]
+  then
+    rm -rf "$q_claim"
+  fi
+}
@@ -0,0 +1,175 @@
+# SOURCECACHE.PY
+# Per-source cache shared with the shell scripts (see cache.sh)
+#
+# Things about a source file that take long to find out (stream properties,
+# frame timestamps, source filter indexes, motion vectors) are stored once in
+# <cache dir>/<kind>/<source key>.*, where the key changes when the file is
+# replaced or modified. The files are written by whichever tool needs them
+# first and read by all the others, so a batch run again skips all the probing
+# and indexing.
+
+import bisect
+import hashlib
+import os
+import re
+import subprocess
+
+# Cache directory shared by all the file_proc_vs tools
+def cachedir():
+
+	path = os.environ.get("FPVS_CACHE_DIR")
+	if not path:
+		path = os.path.join(os.environ.get("XDG_CACHE_HOME",
+				os.path.expanduser("~/.cache")), "file_proc_vs")
+
+	return path
+
+# Identity of a source file: changes if the file is replaced or modified
+def sourcekey(filename):
+
+	st = os.stat(filename)
+	ident = "%s\0%d\0%d" % (os.path.realpath(filename), st.st_size,
+			st.st_mtime_ns)
+
+	return hashlib.sha1(ident.encode()).hexdigest()
+
+# Name of a cache file of a source, the directory is created
+def cachefile(filename, kind, ext=""):
+
+	path = os.path.join(cachedir(), kind)
+	os.makedirs(path, exist_ok=True)
+
+	return os.path.join(path, sourcekey(filename)+ext)
+
+# Write a cache file atomically (parallel processes may be writing it too)
+def _write(path, text):
+
+	tmp = "%s.%d" % (path, os.getpid())
+	with open(tmp, "w") as f:
+		f.write(text)
+	os.replace(tmp, path)
+
+# Properties of a stream as reported by ffprobe, as a dict of strings
+# stream: ffprobe stream specifier (v:0, a:0, a:1...) or "format" for the
+# properties of the container
+def probe(filename, stream="v:0"):
+
+	path = cachefile(filename, "probe", "."+stream.replace(":", ""))
+	if not os.path.exists(path):
+		if stream=="format":
+			show = ["-show_format"]
+		else:
+			show = ["-show_streams", "-select_streams", stream]
+		out = subprocess.run(["ffprobe", "-v", "error"]+show+["-of",
+				"default=nw=1", filename], stdout=subprocess.PIPE, check=True,
+				text=True).stdout
+		_write(path, out)
+
+	props = {}
+	with open(path) as f:
+		for line in f:
+			key, sep, value = line.rstrip("\n").partition("=")
+			if sep: props[key] = value
+
+	return props
+
+# Timestamps of all the video packets in display order (seconds, not relative
+# to the first frame), read without decoding (the frame index of cache.sh)
+def _packettimes(filename):
+
+	path = cachefile(filename, "index", ".pts")
+	if not os.path.exists(path):
+		out = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0",
+				"-show_entries", "packet=pts_time,dts_time", "-of", "csv=p=0",
+				filename], stdout=subprocess.PIPE, check=True, text=True).stdout
+		times = []
+		for line in out.splitlines():
+			fields = line.split(",")
+			t = fields[0] if fields[0] not in ("", "N/A") else fields[-1]
+			if t not in ("", "N/A"):
+				times.append(float(t))
+		if not times:
+			return []
+		times.sort()
+		_write(path, "".join("%.6f\n" % t for t in times))
+
+	with open(path) as f:
+		return [float(line) for line in f]
+
+# Timestamps of all the frames output by the source filter (seconds, not
+# relative to the first frame). With soft telecine (MPEG-2 with repeat-field
+# flags, looked for in the first 500 frames and the 500 frames from the
+# middle) functions.source (LWLibavSource with repeat=1) outputs more frames
+# than there are packets: the decoded frames are read (decoding the whole
+# file) and the frames made of the repeated fields are added, like
+# cache_frames of cache.sh does. Otherwise the packet timestamps are used.
+def timestamps(filename):
+
+	path = cachefile(filename, "index", ".frames")
+	if not os.path.exists(path):
+		packets = _packettimes(filename)
+		if not packets:
+			return []
+		mid = packets[len(packets)//2]-packets[0]
+		out = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0",
+				"-read_intervals", "%%+#500,%f%%+#500" % mid, "-show_entries",
+				"frame=repeat_pict", "-of", "csv=p=0", filename],
+				stdout=subprocess.PIPE, check=True, text=True).stdout
+		if not re.search("[1-9]", out):
+			times = packets
+		else:
+			out = subprocess.run(["ffprobe", "-v", "error", "-select_streams",
+					"v:0", "-show_entries",
+					"frame=best_effort_timestamp_time,pkt_dts_time,repeat_pict", "-of",
+					"compact=p=0", filename], stdout=subprocess.PIPE, check=True,
+					text=True).stdout
+			frames = []
+			for line in out.splitlines():
+				props = dict(kv.partition("=")[::2] for kv in line.split("|"))
+				t = props.get("best_effort_timestamp_time", "N/A")
+				if t=="N/A": t = props.get("pkt_dts_time", "N/A")
+				if t not in ("", "N/A"):
+					frames.append((float(t), int(props.get("repeat_pict") or 0)))
+			if not frames:
+				return []
+			frames.sort()
+			# every frame has 2+repeat_pict fields, 2 fields make a frame
+			times = []
+			fields = 0
+			for i, (t, r) in enumerate(frames):
+				if i+1<len(frames):
+					nt = frames[i+1][0]
+				else:
+					nt = t+(t-frames[i-1][0] if i else 0)
+				fields += 2+r
+				k = fields//2-len(times)
+				times += [t+(nt-t)*j/k for j in range(k)]
+		_write(path, "".join("%.6f\n" % t for t in times))
+
+	with open(path) as f:
+		return [float(line) for line in f]
+
+# Scene cuts: numbers of the first frames of the scenes (without frame 0),
+# found once by the scene score of ffmpeg on a downscaled copy and converted
+# to the numbers of the frames output by the source filter (see timestamps). Empty if the video has no
+# timestamps. The same file is written by cache_scenecuts of cache.sh.
+# threshold: scene score (0..1) above which a frame starts a new scene
+def scenecuts(filename, threshold=0.3):
+
+	path = cachefile(filename, "scenecuts", ".%g" % threshold)
+	if not os.path.exists(path):
+		times = timestamps(filename)
+		out = subprocess.run(["ffmpeg", "-nostdin", "-hide_banner", "-loglevel",
+				"error", "-copyts", "-i", filename, "-map", "0:v:0", "-vf",
+				"scale=256:-2,select='gt(scene,%g)',metadata=print:file=-" %
+				threshold, "-f", "null", "-"], stdout=subprocess.PIPE, check=True,
+				text=True).stdout
+		cuts = []
+		for m in re.finditer(r"pts_time:(\S+)", out):
+			n = bisect.bisect_left(times, float(m.group(1))-0.0001)
+			if 0<n<len(times) and (not cuts or n>cuts[-1]):
+				cuts.append(n)
+		_write(path, "".join("%d\n" % n for n in cuts))
+
+	with open(path) as f:
+		return [int(line) for line in f]
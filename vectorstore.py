@@ -0,0 +1,187 @@
+# VECTORSTORE.PY
+# Persistent on-disk store of MVTools motion vectors (used by functions.py)
+#
+# Every vector node is backed by a pair of files in a per-source directory:
+# <name>.dat holds the vector frames (frame properties and plane data) and is
+# memory-mapped for reading, <name>.idx is an append-only list of (frame,
+# offset, length) records. Frames found in the store are served from it, the
+# others are computed by MVTools and appended, so a store gets filled by
+# previews and partial renders as well and is safe to share between parallel
+# processes.
+#
+# The store is keyed by the source file (path, size and mtime), the analysis
+# parameters and a fingerprint of the analysed clip (its length and several
+# frames spread over it), so changing thsad/thsadc or other non-analysis
+# parameters reuses the vectors, while changing the filters before the
+# analysis (in a way that alters the picture) does not. A change that leaves
+# all the sampled frames the same is not noticed, set FPVS_MVSTORE_CLEAR=1
+# (see functions.mvstore) after such a change.
+
+import vapoursynth as vs
+from vapoursynth import core
+import ctypes
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+from sourcecache import cachedir, sourcekey
+
+_idx_record = struct.Struct("<iQI")
+
+# Plane data of a frame as a list of (stride, bytes)
+def _getplanes(f):
+
+	planes = []
+	for p in range(f.format.num_planes):
+		stride = f.get_stride(p)
+		height = f.height if p==0 else f.height>>f.format.subsampling_h
+		size = stride*height
+		planes.append((stride, ctypes.string_at(f.get_read_ptr(p).value, size)))
+
+	return planes
+
+# Copy plane data saved by _getplanes to a writable frame
+def _setplanes(f, planes):
+
+	for p, (stride, data) in enumerate(planes):
+		if p>=f.format.num_planes: break
+		dst = f.get_write_ptr(p).value
+		dst_stride = f.get_stride(p)
+		if dst_stride==stride:
+			ctypes.memmove(dst, data, len(data))
+		else:
+			row = min(stride, dst_stride)
+			for y in range(len(data)//stride):
+				ctypes.memmove(dst+y*dst_stride, data[y*stride:y*stride+row], row)
+
+
+#--------
+# Record
+#--------
+# Data and index files of a single vector node
+
+class _Record:
+
+	def __init__(self, path):
+
+		self.lock = threading.Lock()
+		self.index = {}
+		self.data = None
+		self.datafile = open(path+".dat", "ab")
+		self.idxfile = open(path+".idx", "ab")
+
+		# load the index, a torn last record (crash) is ignored
+		with open(path+".idx", "rb") as idx:
+			buf = idx.read()
+		for i in range(len(buf)//_idx_record.size):
+			n, offset, length = _idx_record.unpack_from(buf, i*_idx_record.size)
+			self.index[n] = (offset, length)
+
+		if self.index:
+			with open(path+".dat", "rb") as dat:
+				self.data = mmap.mmap(dat.fileno(), 0, access=mmap.ACCESS_READ)
+			size = len(self.data)
+			self.index = {n: v for n, v in self.index.items() if v[0]+v[1]<=size}
+
+	def has(self, n):
+
+		return n in self.index
+
+	def get(self, n, f):
+
+		offset, length = self.index[n]
+		payload = pickle.loads(self.data[offset:offset+length])
+		for key, value in payload["props"].items():
+			f.props[key] = value
+		_setplanes(f, payload["planes"])
+
+	def put(self, n, f):
+
+		payload = pickle.dumps({
+			"props": {k: v for k, v in f.props.items() if k.startswith("MVTools")},
+			"planes": _getplanes(f)}, pickle.HIGHEST_PROTOCOL)
+
+		with self.lock:
+			# other processes may be appending to the same files
+			fcntl.flock(self.idxfile, fcntl.LOCK_EX)
+			try:
+				self.datafile.seek(0, os.SEEK_END)
+				offset = self.datafile.tell()
+				self.datafile.write(payload)
+				self.datafile.flush()
+				self.idxfile.write(_idx_record.pack(n, offset, len(payload)))
+				self.idxfile.flush()
+			finally:
+				fcntl.flock(self.idxfile, fcntl.LOCK_UN)
+
+
+#-------------
+# VectorStore
+#-------------
+
+class VectorStore:
+
+	def __init__(self, filename, path=None):
+
+		if path==None:
+			path = os.path.join(cachedir(), "mvstore", sourcekey(filename))
+		os.makedirs(path, exist_ok=True)
+		self.path = path
+		self.records = {}
+
+	def clear(self):
+
+		for name in os.listdir(self.path):
+			if name.endswith(".dat") or name.endswith(".idx"):
+				os.remove(os.path.join(self.path, name))
+
+	# Short stable description of the picture content of a clip: the format,
+	# the length and a number of frames (samples) spread evenly from the first
+	# to the last
+	def fingerprint(self, clip, samples=9):
+
+		h = hashlib.sha1()
+		h.update(("%s %d %d %d" % (clip.format.name, clip.width, clip.height,
+				clip.num_frames)).encode())
+		last = clip.num_frames-1
+		for n in sorted({last*i//max(samples-1, 1) for i in range(samples)}):
+			for stride, data in _getplanes(clip.get_frame(n)):
+				h.update(data)
+
+		return h.hexdigest()[:16]
+
+	# Return a node that serves the vectors from the store where available and
+	# stores the rest as they are computed
+	# desc: deterministic description of the node (analysis parameters)
+	def wrap(self, vec, desc):
+
+		# the description covers the content, so nodes with the same one have
+		# the same vectors and share the record
+		name = hashlib.sha1(desc.encode()).hexdigest()
+		if name not in self.records:
+			self.records[name] = _Record(os.path.join(self.path, name))
+		rec = self.records[name]
+
+		def write(n, f):
+			rec.put(n, f)
+			return f
+
+		def read(n, f):
+			fout = f.copy()
+			rec.get(n, fout)
+			return fout
+
+		writer = core.std.ModifyFrame(vec, vec, write)
+		if not rec.index:
+			return writer
+
+		blank = core.std.BlankClip(vec, keep=True)
+		reader = core.std.ModifyFrame(blank, blank, read)
+
+		def select(n):
+			return reader if rec.has(n) else writer
+
+		return core.std.FrameEval(vec, select)
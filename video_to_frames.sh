@@ -1,19 +1,44 @@
 #!/bin/sh
 # Copyleft 2020-2023 Efenstor
+# Revision 2026-10-18
 
 # Internal defines
+SDIR="$( cd "$( dirname "$0" )" >/dev/null 2>&1 && pwd )"
 RED="\033[0;31m"
 GREEN="\033[0;32m"
 CYAN="\033[0;36m"
 YELLOW="\033[1;33m"
 NC="\033[0m"
 
+# Parse the named parameters
+optstr="?j:u"
+jobs=1
+while getopts $optstr opt; do
+  case "$opt" in
+    j) jobs=$OPTARG
+       ;;
+    u) uncompressed=true
+       ;;
+    :) echo "Missing argument for -$OPTARG" >&2
+       exit 1
+       ;;
+  esac
+done
+shift $((OPTIND - 1))
+
 # Show help
 if [ $# -lt 3 ]; then
   printf "\n${YELLOW}Convert video file to frame image files using ffmpeg
 ${GREEN}(copyleft) Efenstor${NC}\n
-Usage: video_to_frames.sh <src_file> <images_dir> <images_ext> [segment_start]
-       [segment_end]\n
+Usage: video_to_frames.sh [options] <src_file> <images_dir> <images_ext>
+       [segment_start] [segment_end]\n
+Options:
+  -j jobs        split the video at keyframes into this number of parts
+                 extracted by parallel ffmpeg processes (the frames are numbered
+                 the same as with a single process)
+  -u             write the images without compression (faster, for intermediate
+                 frames): PNG with compression level 0 or uncompressed TIFF;
+                 BMP, PPM and PAM are always uncompressed
 Parameters:
   src_file       source video file
   images_dir     directory with frame image files
@@ -41,7 +66,7 @@ dst_ext="$3"
 # Prepare the destination dir
 if [ ! -e "$dst_dir" ] || [ ! -d "$dst_dir" ]; then
   mkdir "$dst_dir"
-elif [ $(find "frames2" -maxdepth 1 -type d -empty | wc -l) > /dev/null -eq 0 ]; then
+elif [ $(find "$dst_dir" -maxdepth 0 -type d -empty | wc -l) -eq 0 ]; then
   read -p "The destination directory is not empty. Should it be purged? (y/N)" ans
   if [ "$ans" = "y" ]; then
     # This may look stupid but it allows to delete
@@ -51,15 +76,108 @@ elif [ $(find "frames2" -maxdepth 1 -type d -empty | wc -l) > /dev/null -eq 0 ];
   fi
 fi
 
-# Seek position
-if [ $# -gt 3 ]; then
-  ss="-ss $4"
+# Options of the image encoder
+if [ $uncompressed ]; then
+  case "$dst_ext" in
+    png|PNG) image_options="-compression_level 0"
+       ;;
+    tif|tiff|TIF|TIFF) image_options="-compression_algo raw"
+       ;;
+  esac
 fi
-# To position
-if [ $# -gt 4 ]; then
-  to="-to $5"
+
+# Single process
+if [ $jobs -le 1 ]; then
+  # Seek position
+  if [ $# -gt 3 ]; then
+    ss="-ss $4"
+  fi
+  # To position
+  if [ $# -gt 4 ]; then
+    to="-to $5"
+  fi
+  # Do the job
+  ffmpeg -loglevel info -i "$src_file" $ss $to $image_options \
+    "$dst_dir/%08d.$dst_ext"
+  exit
 fi
 
-# Do the job
-ffmpeg -loglevel info -i "$src_file" $ss $to "$dst_dir/%08d.$dst_ext"
+# Time in the ffmpeg format to seconds
+to_seconds() {
+  echo "$1" | awk -F: '{
+    t = 0
+    for (i = 1; i <= NF; i++) t = t * 60 + $i
+    if ($NF ~ /ms$/) t /= 1000
+    else if ($NF ~ /us$/) t /= 1000000
+    print t }'
+}
 
+# Split the frames of the segment into parts starting at keyframes, from the
+# frame index (see cache.sh). Every part is decoded from a time halfway between
+# its first frame and the previous one, so that ffmpeg seeks to the keyframe
+# before and drops exactly the frames of the previous part.
+# Prints a line per part: seek time, number of frames, number of the first frame
+. "$SDIR/cache.sh"
+index=$(cache_index "$src_file")
+if [ $? -ne 0 ]; then
+  echo "The frame index cannot be built (no timestamps), use a single job" >&2
+  exit 1
+fi
+seg_start=0
+seg_end=
+if [ $# -gt 3 ]; then seg_start=$(to_seconds "$4"); fi
+if [ $# -gt 4 ]; then seg_end=$(to_seconds "$5"); fi
+base=$(cache_probe "$src_file" format start_time)
+parts=$(awk -v s=$seg_start -v e="$seg_end" -v jobs=$jobs -v base=${base:-0} '
+  FNR == NR { key[sprintf("%.6f", $1)] = 1; next }
+  { pts[n++] = $1 }
+  END {
+    f0 = 0
+    while (f0 < n && pts[f0] < base + s - 0.0001) f0++
+    f1 = f0
+    while (f1 < n && (e == "" || pts[f1] < base + e - 0.0001)) f1++
+    if (f1 <= f0) exit
+    m = 0
+    first[m++] = f0
+    for (i = 1; i < jobs; i++) {
+      k = f0 + int((f1 - f0) * i / jobs)
+      if (k <= first[m - 1]) k = first[m - 1] + 1
+      while (k < f1 && !(sprintf("%.6f", pts[k]) in key)) k++
+      if (k >= f1) break
+      first[m++] = k
+    }
+    first[m] = f1
+    for (i = 0; i < m; i++) {
+      k = first[i]
+      seek = (k > 0) ? (pts[k - 1] + pts[k]) / 2 - base : 0
+      printf "%.6f %d %d\n", (seek > 0) ? seek : 0, first[i + 1] - k, k - f0 + 1
+    }
+  }' "${index%.pts}.key" "$index")
+if [ ! "$parts" ]; then
+  echo "No frames in the segment" >&2
+  exit 1
+fi
+
+# Extract the parts in parallel
+echo "Extracting $(echo "$parts" | awk '{ n += $2 } END { print n }') frames in \
+$(echo "$parts" | wc -l) parts..."
+pids=
+trap 'for p in $pids; do kill $p; done 2>/dev/null' INT TERM
+while read -r seek count number; do
+  ffmpeg -nostdin -loglevel error -ss $seek -i "$src_file" -map 0:v:0 \
+    -fps_mode passthrough -frames:v $count -start_number $number \
+    $image_options "$dst_dir/%08d.$dst_ext" &
+  pids="$pids $!"
+done << EOF
+$parts
+EOF
+failed=
+for p in $pids; do
+  wait $p || failed=true
+done
+trap - INT TERM
+# Cancelled
+if [ $failed ]; then
+  printf "${RED}Extraction failed or cancelled${NC}\n" >&2
+  exit 1
+fi